@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+bench.py: synthetic-scale benchmarks for one-shot and watch mode.
+
+Puts fake `distrobox`, `podman`, `journalctl` and `konsole` executables on
+PATH, and runs `generate_profiles` and `watch_journal` in child processes
+against a temporary HOME. Results are written as JSON.
+
+Usage:
+    python3 benchmarks/bench.py --containers 1,100,10000 --output out.json
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import os
+import sys
+import json
+import shutil
+import signal
+import platform
+import subprocess
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep, time
+from typing import Any, Dict, List, Optional
+
+REPO = Path(__file__).resolve().parent.parent
+PROFILE_PREFIX = "konsole-distrobox-integration-distrobox-"
+IMAGE_VARIANTS = 50
+POLL_INTERVAL = 0.005
+
+FAKE_DISTROBOX = """#!/bin/sh
+exec cat "$BENCH_DIR/distrobox-list.txt"
+"""
+FAKE_PODMAN = """#!/bin/sh
+exec cat "$BENCH_DIR/podman-ps.json"
+"""
+FAKE_KONSOLE = """#!/bin/sh
+exit 0
+"""
+# Follows the journal file from its end, like `journalctl --follow
+# --lines 0`, and marks itself ready once positioned.
+FAKE_JOURNALCTL = """#!{python}
+import os, sys, time
+journal = open(os.path.join(os.environ["BENCH_DIR"], "journal"), "rb")
+journal.seek(0, os.SEEK_END)
+open(os.path.join(os.environ["BENCH_DIR"], "journalctl.ready"), "w").close()
+while True:
+    line = journal.readline()
+    if len(line) == 0:
+        time.sleep({poll})
+        continue
+    sys.stdout.buffer.write(line)
+    sys.stdout.buffer.flush()
+"""
+
+
+class BenchEnv:
+    """
+    A temporary HOME and fake tool directory for one container count and
+    icon directory size.
+    """
+
+    def __init__(self, root: Path, containers: int, icons: int) -> None:
+        self.root = root
+        self.home = root / "home"
+        self.bin = root / "bin"
+        self.konsole_dir = self.home / ".local/share/konsole"
+        self.cache_dir = self.home / ".cache"
+        self.containers = containers
+        self.icons = icons
+        self.storms = 0
+
+        self.bin.mkdir(parents=True)
+        self.konsole_dir.mkdir(parents=True)
+        (self.home / ".config").mkdir(parents=True)
+        (self.home / ".config/konsolerc").write_text(
+            "[Desktop Entry]\nDefaultProfile=Default.profile\n"
+        )
+        (root / "journal").touch()
+        for name, script in [
+            ("distrobox", FAKE_DISTROBOX),
+            ("podman", FAKE_PODMAN),
+            ("konsole", FAKE_KONSOLE),
+            (
+                "journalctl",
+                FAKE_JOURNALCTL.format(python=sys.executable, poll=POLL_INTERVAL),
+            ),
+        ]:
+            path = self.bin / name
+            path.write_text(script)
+            path.chmod(0o755)
+        self.write_containers()
+        self.write_icons()
+
+    def get_image(self, i: int) -> str:
+        return f"registry.example.com/bench/distro{i % IMAGE_VARIANTS}:latest"
+
+    def write_containers(self) -> None:
+        """
+        Write the `podman ps --format json` and `distrobox list` outputs.
+        """
+        entries = [
+            {
+                "Id": f"{i:064x}",
+                "Names": [f"box{i}"],
+                "Image": self.get_image(i),
+                "State": "running" if i % 2 == 0 else "exited",
+                "Labels": {"manager": "distrobox"},
+            }
+            for i in range(self.containers)
+        ]
+        (self.root / "podman-ps.json").write_text(json.dumps(entries))
+        rows = ["ID           | NAME | STATUS | IMAGE"]
+        rows += [
+            f"{e['Id'][:12]} | {e['Names'][0]} | {e['State']} | {e['Image']}"
+            for e in entries
+        ]
+        (self.root / "distrobox-list.txt").write_text("\n".join(rows) + "\n")
+
+    def write_icons(self) -> None:
+        """
+        Fill the Distrobox icon directory: one icon per image variant (as
+        far as the size allows), the rest unrelated.
+        """
+        icon_dir = self.home / ".local/share/icons/distrobox"
+        icon_dir.mkdir(parents=True)
+        for i in range(self.icons):
+            stem = f"distro{i}" if i < IMAGE_VARIANTS else f"unrelated{i}"
+            (icon_dir / f"{stem}.png").write_bytes(b"\x89PNG\r\n\x1a\n")
+
+    def get_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update(
+            {
+                "HOME": str(self.home),
+                "XDG_CACHE_HOME": str(self.cache_dir),
+                "XDG_CONFIG_HOME": str(self.home / ".config"),
+                "XDG_DATA_HOME": str(self.home / ".local/share"),
+                "XDG_DATA_DIRS": str(self.root / "system"),
+                "PATH": f"{self.bin}:{env.get('PATH', '')}",
+                "PYTHONPATH": str(REPO / "src"),
+                "BENCH_DIR": str(self.root),
+            }
+        )
+        env.pop("XDG_RUNTIME_DIR", None)
+        return env
+
+    def reset_outputs(self) -> None:
+        """
+        Remove generated profiles and caches, for a cold run.
+        """
+        shutil.rmtree(self.konsole_dir)
+        self.konsole_dir.mkdir()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def get_profile_path(self, name: str) -> Path:
+        return self.konsole_dir / f"{PROFILE_PREFIX}{name}.profile"
+
+    def append_events(self, events: List[Dict[str, str]]) -> float:
+        """
+        Append journal entries in one write.
+
+        Returns:
+            float: the wall-clock time of the write.
+        """
+        now = time()
+        lines = []
+        for e in events:
+            e["__REALTIME_TIMESTAMP"] = str(int(now * 1_000_000))
+            lines.append(json.dumps(e) + "\n")
+        with open(self.root / "journal", "a") as f:
+            f.write("".join(lines))
+        return now
+
+    def make_create_event(self, name: str) -> Dict[str, str]:
+        return {
+            "SYSLOG_IDENTIFIER": "podman",
+            "PODMAN_TYPE": "container",
+            "PODMAN_EVENT": "create",
+            "PODMAN_ID": f"{abs(hash(name)):064x}",
+            "PODMAN_NAME": name,
+            "PODMAN_IMAGE": self.get_image(len(name)),
+            "PODMAN_LABELS": json.dumps({"manager": "distrobox"}),
+        }
+
+
+def run_child(env: BenchEnv, args: List[str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, __file__, "--child", *args],
+        env=env.get_env(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_child(process: subprocess.Popen) -> int:
+    """
+    Reap a child process.
+
+    Returns:
+        int: its peak resident set size, in KiB.
+    """
+    _, _, usage = os.wait4(process.pid, 0)
+    process.returncode = 0
+    return usage.ru_maxrss
+
+
+def wait_for(path: Path, timeout: float) -> Optional[float]:
+    """
+    Poll until a file exists.
+
+    Returns:
+        Optional[float]: the wall-clock time it was seen, or None on timeout.
+    """
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if path.exists():
+            return time()
+        sleep(POLL_INTERVAL)
+    return None
+
+
+def bench_oneshot(env: BenchEnv, backend: str) -> List[Dict[str, Any]]:
+    """
+    Time a cold run (no profiles, no caches) and a run with nothing to do.
+    """
+    results = []
+    env.reset_outputs()
+    for scenario in ["cold", "no-change"]:
+        process = run_child(env, ["oneshot", backend])
+        stdout = process.stdout.read()
+        rss = wait_child(process)
+        results.append(
+            {
+                "scenario": scenario,
+                "seconds": json.loads(stdout)["seconds"],
+                "peak_rss_kib": rss,
+            }
+        )
+    return results
+
+
+def bench_watch(
+    env: BenchEnv, backend: str, storms: List[int], quiet_window: float
+) -> List[Dict[str, Any]]:
+    """
+    Start the watcher and time its initial rescan from launch to the last
+    profile file, then measure the time from journal write to profile
+    file for event storms of each size.
+    """
+    results = []
+    env.reset_outputs()
+    ready = env.root / "journalctl.ready"
+    ready.unlink(missing_ok=True)
+    # The watcher reconciles on startup without waiting for an event, so
+    # the rescan is timed from launch.
+    start = time()
+    process = run_child(env, ["watch", backend, str(quiet_window)])
+    try:
+        if wait_for(ready, 30) is None:
+            raise RuntimeError("watcher did not start")
+        last = env.get_profile_path(f"box{env.containers - 1}")
+        seen = wait_for(last, 600)
+        results.append(
+            {
+                "scenario": "watch-initial-rescan",
+                "seconds": None if seen is None else seen - start,
+            }
+        )
+        for size in storms:
+            env.storms += 1
+            names = [f"storm{env.storms}x{i}" for i in range(size)]
+            start = env.append_events([env.make_create_event(n) for n in names])
+            latencies = []
+            for n in names:
+                seen = wait_for(env.get_profile_path(n), 60)
+                latencies.append(None if seen is None else seen - start)
+            done = [v for v in latencies if v is not None]
+            results.append(
+                {
+                    "scenario": "watch-event-storm",
+                    "events": size,
+                    "first_profile_seconds": min(done) if done else None,
+                    "last_profile_seconds": max(done) if done else None,
+                    "missed": len(latencies) - len(done),
+                }
+            )
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.stdout.close()
+        rss = wait_child(process)
+    for r in results:
+        r["peak_rss_kib"] = rss
+    return results
+
+
+def child_main(args: List[str]) -> None:
+    """
+    Run `generate_profiles` or `watch_journal` in this process.
+    """
+    sys.path.insert(0, str(REPO / "src"))
+    from getpass import getuser
+    from time import perf_counter
+
+    from konsoledistroboxintegration.core import generate_profiles, watch_journal
+    from konsoledistroboxintegration.daemon import ProfileDaemon
+
+    mode, backend = args[0], args[1]
+    if mode == "oneshot":
+        start = perf_counter()
+        generate_profiles(getuser(), ["konsole"], ["distrobox"], backend)
+        print(json.dumps({"seconds": perf_counter() - start}))
+        return
+    quiet_window = float(args[2])
+    daemon = ProfileDaemon(getuser(), ["konsole"], ["distrobox"], backend)
+    watch_journal(
+        daemon.handle_events,
+        quiet_window,
+        max(quiet_window, 10.0),
+        24 * 60 * 60,
+        daemon.get_watch_paths(),
+    )
+
+
+def get_args() -> Namespace:
+    def int_list(v: str) -> List[int]:
+        return [int(x) for x in v.split(",")]
+
+    parser = ArgumentParser(
+        description="Synthetic-scale benchmarks for konsole-distrobox-integration."
+    )
+    parser.add_argument(
+        "--containers",
+        type=int_list,
+        default=[1, 10, 100, 1000, 10000],
+        help="container counts (default: 1,10,100,1000,10000)",
+    )
+    parser.add_argument(
+        "--icons",
+        type=int_list,
+        default=[0, 50, 5000],
+        help="icon directory sizes (default: 0,50,5000)",
+    )
+    parser.add_argument(
+        "--storms",
+        type=int_list,
+        default=[1, 10, 100],
+        help="event storm sizes for watch mode (default: 1,10,100)",
+    )
+    parser.add_argument(
+        "--backends",
+        type=lambda v: v.split(","),
+        default=["podman", "distrobox"],
+        help="listing backends (default: podman,distrobox)",
+    )
+    parser.add_argument(
+        "--quiet-window",
+        type=float,
+        default=0.1,
+        help="watcher quiet window, in seconds (default: 0.1)",
+    )
+    parser.add_argument(
+        "--no-watch", action="store_true", help="skip the watch mode benchmarks"
+    )
+    parser.add_argument(
+        "--output", type=Path, help="write results here instead of stdout"
+    )
+    return parser.parse_args()
+
+
+def get_meta() -> Dict[str, Any]:
+    try:
+        revision = subprocess.run(
+            ["git", "-C", str(REPO), "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        revision = ""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "revision": revision or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child_main(sys.argv[2:])
+        return
+    args = get_args()
+    runs = []
+    for containers in args.containers:
+        for icons in args.icons:
+            with TemporaryDirectory(prefix="kdi-bench-") as root:
+                env = BenchEnv(Path(root), containers, icons)
+                for backend in args.backends:
+                    params = {
+                        "containers": containers,
+                        "icons": icons,
+                        "backend": backend,
+                    }
+                    results = bench_oneshot(env, backend)
+                    if not args.no_watch:
+                        results += bench_watch(
+                            env, backend, args.storms, args.quiet_window
+                        )
+                    for r in results:
+                        runs.append({**params, **r})
+                        print(json.dumps(runs[-1]), file=sys.stderr)
+    output = json.dumps(
+        {"meta": {**get_meta(), "quiet_window": args.quiet_window}, "runs": runs},
+        indent=4,
+    )
+    if args.output is not None:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,13 +13,21 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
+import json
 import logging
 from sys import stderr
 from argparse import ArgumentParser, Namespace
 from os import geteuid
 from getpass import getuser
+from pathlib import Path
 
 from konsoledistroboxintegration.core import generate_profiles, watch_journal
+from konsoledistroboxintegration.daemon import ProfileDaemon
+from konsoledistroboxintegration.ipc import REFRESH_TIMEOUT, send_request
+from konsoledistroboxintegration.metrics import format_cycle
+
+# Seconds to wait for a running watcher's status.
+STATUS_TIMEOUT = 5.0
 
 
 def configure_logs(show_all: bool) -> None:
@@ -68,15 +76,166 @@ def get_args() -> Namespace:
         action="store_true",
         help="watch journal for Podman updates and regenerate accordingly",
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="ask a running watcher to regenerate profiles now (with -f, from "
+        "scratch); regenerates in this process if no watcher is running",
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="print the state of a running watcher as JSON",
+    )
     parser.add_argument(
         "-l",
         "--log",
         action="store_true",
         help="output all non-error log information to console",
     )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="regenerate profiles even if their inputs haven't changed",
+    )
+    parser.add_argument(
+        "-t",
+        "--targets",
+        type=lambda v: v.split(","),
+        default=["konsole"],
+        metavar="TARGET[,TARGET...]",
+        help="where to write profiles: konsole (also used by yakuake), "
+        "desktop (application menu launchers), or all (default: konsole)",
+    )
+    parser.add_argument(
+        "-s",
+        "--sources",
+        type=lambda v: v.split(","),
+        default=["distrobox"],
+        metavar="SOURCE[,SOURCE...]",
+        help="where to read profiles from: distrobox, toolbox, podman, ssh, "
+        "or all (default: distrobox)",
+    )
+    parser.add_argument(
+        "--source-timeout",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="use a source's cached profiles if it takes longer than this "
+        "(default: 10.0)",
+    )
+    parser.add_argument(
+        "--target-timeout",
+        type=float,
+        default=30.0,
+        metavar="SECONDS",
+        help="give up on a target that takes longer than this (default: 30.0)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["auto", "libpod", "podman", "distrobox"],
+        default="auto",
+        help="list containers through the podman API socket, with `podman "
+        "ps`, or with `distrobox list`; auto uses the first one available "
+        "(default: auto)",
+    )
+    parser.add_argument(
+        "--events",
+        choices=["auto", "journal", "libpod"],
+        default="auto",
+        help="in watch mode, read Podman events from the systemd journal or "
+        "from the podman API socket; auto uses the journal when available "
+        "(default: auto)",
+    )
+    parser.add_argument(
+        "--quiet-window",
+        type=float,
+        default=2.0,
+        metavar="SECONDS",
+        help="in watch mode, wait this long after the last event before "
+        "regenerating (default: 2.0)",
+    )
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="in watch mode, never delay a regeneration by more than this "
+        "after the first event of a burst (default: 10.0)",
+    )
+    parser.add_argument(
+        "--rescan-interval",
+        type=float,
+        default=600.0,
+        metavar="SECONDS",
+        help="in watch mode, apply events as per-container updates, and "
+        "rewrite all profiles from a full rescan this often (default: 600.0)",
+    )
+    parser.add_argument(
+        "--fast-enter",
+        action="store_true",
+        help="open running Distrobox containers in Konsole with the `podman "
+        "exec` command `distrobox enter` would run, resolved once per "
+        "container, skipping the distrobox script",
+    )
+    parser.add_argument(
+        "--stats-file",
+        type=Path,
+        metavar="PATH",
+        help="after each regeneration, write counters and phase timings to "
+        "this file: in the Prometheus text format if it ends in .prom (for "
+        "the node exporter's textfile collector), else as JSON",
+    )
+    parser.add_argument(
+        "--latency-threshold",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="in watch mode, warn when a profile update lands this long after "
+        "its Podman event (default: 10.0)",
+    )
     return parser.parse_args()
 
 
+def ask_watcher(status: bool, force: bool) -> bool:
+    """
+    Send a `--status` or `--refresh` request to a running watcher, and
+    report its reply. Fatally exits if there is no watcher to ask for
+    status, or the request fails.
+
+    Args:
+        status (bool): ask for status, else for a refresh.
+        force (bool): refresh from scratch.
+
+    Returns:
+        bool: True if the watcher handled the request, False if no
+              watcher is running and a refresh should run in-process.
+    """
+    request = (
+        {"command": "status"} if status else {"command": "refresh", "force": force}
+    )
+    try:
+        reply = send_request(request, STATUS_TIMEOUT if status else REFRESH_TIMEOUT)
+    except (OSError, ValueError) as e:
+        logging.fatal(f"Request to the watcher failed: {e!r}")
+        exit(1)
+    if reply is None:
+        if status:
+            logging.fatal("No watcher is running.")
+            exit(1)
+        logging.info("No watcher is running, regenerating profiles in-process.")
+        return False
+    if not reply.get("ok"):
+        logging.fatal(f"The watcher failed: {reply.get('error')}")
+        exit(1)
+    if status:
+        print(json.dumps(reply["status"], indent=4))
+    else:
+        logging.info(f"Watcher regenerated profiles: {format_cycle(reply['cycle'])}.")
+    return True
+
+
 def main() -> None:
     """
     The main script routine.
@@ -84,11 +243,47 @@ def main() -> None:
     current_user = get_user()
     args = get_args()
     configure_logs(args.log)
-    callback = lambda: generate_profiles(current_user, ["konsole"])  # noqa: E731
+    targets = args.targets
     if args.watch:
-        watch_journal(callback)
+        daemon = ProfileDaemon(
+            current_user,
+            targets,
+            args.sources,
+            args.backend,
+            args.target_timeout,
+            args.source_timeout,
+            args.fast_enter,
+        )
+        watch_journal(
+            daemon.handle_events,
+            args.quiet_window,
+            args.max_delay,
+            args.rescan_interval,
+            daemon.get_watch_paths(),
+            args.stats_file,
+            args.latency_threshold,
+            daemon.resume(),
+            get_status=daemon.get_status,
+            classify=(
+                daemon.classifier.classify if daemon.classifier is not None else None
+            ),
+            event_backend=args.events,
+        )
         return
-    callback()
+    if args.status or args.refresh:
+        if ask_watcher(args.status, args.force):
+            return
+    generate_profiles(
+        current_user,
+        targets,
+        args.sources,
+        args.backend,
+        force=args.force,
+        target_timeout=args.target_timeout,
+        source_timeout=args.source_timeout,
+        stats_file=args.stats_file,
+        fast_enter=args.fast_enter,
+    )
 
 
 if __name__ == "__main__":
@@ -13,22 +13,147 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
-from typing import List
-from subprocess import run, PIPE
+import os
+import signal
+from typing import List, Optional
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL, TimeoutExpired
 from shutil import which
+from threading import Event
+from time import monotonic
 
+# Seconds a command may run before its process group is killed.
+COMMAND_TIMEOUT = 60.0
+# Seconds between cancellation checks while a command is running.
+CANCEL_POLL_INTERVAL = 0.1
 
-def run_command(command: List[str]) -> str:
+
+class CommandError(Exception):
+    """
+    A command exited with a non-zero status, or could not be run.
+    """
+
+    def __init__(
+        self, command: List[str], returncode: Optional[int], stderr: str
+    ) -> None:
+        """
+        Args:
+            command (List[str]): the command, as list with arguments.
+            returncode (Optional[int]): the exit status, or None if the
+                                        command was killed.
+            stderr (str): the captured standard error output.
+        """
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+        detail = stderr.strip().splitlines()[-1] if stderr.strip() else ""
+        super().__init__(
+            f"`{' '.join(command)}` exited with status {returncode}"
+            + (f": {detail}" if detail else "")
+        )
+
+
+class CommandTimeoutError(CommandError):
+    """
+    A command ran past its deadline, and its process group was killed.
+    """
+
+    def __init__(self, command: List[str], timeout: float, stderr: str) -> None:
+        super().__init__(command, None, stderr)
+        self.timeout = timeout
+        self.args = (f"`{' '.join(command)}` timed out after {timeout:.1f} s",)
+
+
+class Cancelled(Exception):
+    """
+    Work was abandoned because it has been superseded.
+    """
+
+
+def check_cancelled(cancel: Optional[Event]) -> None:
+    """
+    Raise `Cancelled` if the cancellation event is set.
+
+    Args:
+        cancel (Optional[Event]): the event, or None if not cancellable.
+    """
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+def kill_process_group(process: Popen) -> str:
+    """
+    Kill a process started in its own session, along with any children
+    it spawned, and reap it.
+
+    Args:
+        process (Popen): the process, with piped output.
+
+    Returns:
+        str: the standard error output it left behind.
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    _, stderr = process.communicate()
+    return stderr.decode("utf-8", "replace")
+
+
+def run_command(
+    command: List[str],
+    timeout: float = COMMAND_TIMEOUT,
+    cancel: Optional[Event] = None,
+    cwd: Optional[Path] = None,
+) -> str:
     """
     Runs a command with subprocess, and return stdout as UTF-8.
 
+    The command runs in its own process group, which is killed if it
+    takes longer than `timeout`, or when `cancel` is set.
+
     Args:
         command (List[str]): the command to run, as list with arguments.
+        timeout (float): seconds before the command is killed.
+        cancel (Optional[Event]): kills the command when set.
+        cwd (Optional[Path]): the working directory; inherited if None.
 
     Returns:
-        str: UTF-8 output of command.
+        str: UTF-8 output of command. Raises `CommandError` on a non-zero
+             exit status, `CommandTimeoutError` past the deadline, and
+             `Cancelled` if cancelled.
     """
-    return run(command, stdout=PIPE).stdout.decode("utf-8")
+    check_cancelled(cancel)
+    try:
+        process = Popen(
+            command,
+            stdin=DEVNULL,
+            stdout=PIPE,
+            stderr=PIPE,
+            start_new_session=True,
+            cwd=cwd,
+        )
+    except OSError as e:
+        raise CommandError(command, None, str(e)) from e
+    deadline = monotonic() + timeout
+    while True:
+        remaining = deadline - monotonic()
+        wait = remaining if cancel is None else min(remaining, CANCEL_POLL_INTERVAL)
+        try:
+            stdout, stderr = process.communicate(timeout=max(wait, 0))
+            break
+        except TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                kill_process_group(process)
+                raise Cancelled()
+            if monotonic() >= deadline:
+                stderr = kill_process_group(process)
+                raise CommandTimeoutError(command, timeout, stderr)
+    if process.returncode != 0:
+        raise CommandError(
+            command, process.returncode, stderr.decode("utf-8", "replace")
+        )
+    return stdout.decode("utf-8")
 
 
 def command_exists(command: str) -> bool:
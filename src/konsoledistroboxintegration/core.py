@@ -14,72 +14,856 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
+import asyncio
 import logging
-from typing import Callable, List
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from asyncio import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+from pathlib import Path
 from shutil import which
-from subprocess import Popen, PIPE, STDOUT
+from signal import SIGINT, SIGTERM
+from time import monotonic, perf_counter, time
+from subprocess import PIPE
+from threading import Event
 
-from konsoledistroboxintegration.commands import command_exists
-from konsoledistroboxintegration.sources import DistroboxProfileGenerator
-from konsoledistroboxintegration.targets import get_targets
+from konsoledistroboxintegration.commands import (
+    Cancelled,
+    CommandError,
+    command_exists,
+    run_command,
+)
+from konsoledistroboxintegration.sources import (
+    ProfileSource,
+    SourceCache,
+    add_fast_enter_commands,
+    collect_profiles,
+    get_sources,
+    DISTROBOX_LABEL,
+)
+from konsoledistroboxintegration.profiles import Profile
+from konsoledistroboxintegration.targets import ProfileTarget, get_targets
+from konsoledistroboxintegration.files import MergePlan, write_file_atomically
+from konsoledistroboxintegration.icons import IconIndex
+from konsoledistroboxintegration.manifests import make_fingerprint
+from konsoledistroboxintegration.scheduler import RegenerationScheduler
+from konsoledistroboxintegration.inotify import Inotify
+from konsoledistroboxintegration.locks import RegenerationLock
+from konsoledistroboxintegration.libpod import (
+    LibpodError,
+    get_podman_socket_path,
+    socket_exists,
+    stream_events,
+)
+from konsoledistroboxintegration.ipc import (
+    complete_requests,
+    start_server,
+    stop_server,
+)
+from konsoledistroboxintegration.metrics import (
+    STATS_FILE_MODE,
+    format_cycle,
+    metrics,
+)
+from konsoledistroboxintegration.events import (
+    EventKind,
+    PodmanEvent,
+    RescanRequest,
+    JOURNAL_FIELDS,
+    get_journal_matches,
+    parse_journal_entry,
+)
 
 
-def generate_profiles(current_user: str, target_query: List[str]) -> None:
+def get_ready_sources(
+    source_query: List[str],
+    current_user: str,
+    backend: str,
+    icon_index: IconIndex,
+    fast_enter: bool = False,
+) -> List[ProfileSource]:
     """
-    Generates Konsole profiles from Distrobox containers.
+    Returns the sources matching a query whose dependencies are
+    satisfied. Fatally exits if there are none.
+
+    Args:
+        source_query (List[str]): the source query, see `get_sources`.
+        current_user (str): the currently logged-in user.
+        backend (str): the Distrobox listing backend, see
+                       `get_distrobox_source`.
+        icon_index (IconIndex): the icon index shared by the sources.
+        fast_enter (bool): give Distrobox profiles fast-enter commands.
+
+    Returns:
+        List[ProfileSource]: the sources.
+    """
+    sources = []
+    for s in get_sources(source_query, current_user, backend, icon_index, fast_enter):
+        if not s.check_dependencies():
+            logging.warning(f"{s.get_source_name()}: Missing dependencies.")
+            continue
+        sources.append(s)
+    if len(sources) < 1:
+        logging.error("No profile sources available.")
+        exit(1)
+    return sources
+
+
+def generate_profiles(
+    current_user: str,
+    target_query: List[str],
+    source_query: Optional[List[str]] = None,
+    backend: str = "auto",
+    icon_index: Optional[IconIndex] = None,
+    force: bool = False,
+    target_timeout: float = 30.0,
+    source_timeout: float = 10.0,
+    stats_file: Optional[Path] = None,
+    fast_enter: bool = False,
+) -> None:
+    """
+    Generates Konsole profiles from Distrobox containers (and other
+    sources).
+
+    Regenerations are single-flight across processes: the targets'
+    lock files are held throughout, see `RegenerationLock`. A process
+    that waited for another still lists containers itself; targets the
+    other process already brought up to date are then skipped by their
+    fingerprints.
+
+    Sources are collected in parallel, see `collect_profiles`. Targets
+    whose stored input fingerprint matches the current inputs (profile
+    listing, target configuration, icon directories and package version)
+    are skipped before any profile is rendered. The remaining targets
+    run concurrently, see `run_targets`.
 
     Args:
         current_user (str): the currently logged-in user, required for
                             reading/writing profile files.
-        target_query (List[str]): the target query -- insignificant for
-                                  now, should always be ["all"] or
-                                  ["konsole"]
+        target_query (List[str]): the target query, see `get_targets`.
+        source_query (Optional[List[str]]): the source query, see
+                                            `get_sources`; Distrobox only
+                                            if None.
+        backend (str): the Distrobox listing backend, see
+                       `get_distrobox_source`.
+        icon_index (Optional[IconIndex]): an icon index to reuse across
+                                          runs; a new one if None.
+        force (bool): regenerate even if the fingerprint matches.
+        target_timeout (float): seconds to wait for each target.
+        source_timeout (float): seconds to wait for each source before
+                                using its cached profiles.
+        stats_file (Optional[Path]): a file to write metrics to, see
+                                     `finish_cycle`.
+        fast_enter (bool): open Distrobox containers in Konsole with a
+                           cached `podman exec` command, see
+                           `EnterCommandCache`.
+    """
+    if source_query is None:
+        source_query = ["distrobox"]
+    metrics.begin_cycle()
+    try:
+        start_time = perf_counter()
+        if icon_index is None:
+            icon_index = IconIndex()
+        sources = get_ready_sources(
+            source_query, current_user, backend, icon_index, fast_enter
+        )
+        targets = get_ready_targets(target_query, current_user)
+        lock = get_regeneration_lock(targets)
+        lock.acquire()
+        try:
+            if not regenerate(
+                sources, icon_index, targets, force, target_timeout, source_timeout
+            ):
+                elapsed = (perf_counter() - start_time) * 1000
+                logging.info(f"Profiles up to date (fast path took {elapsed:.1f} ms).")
+        finally:
+            lock.release()
+    finally:
+        finish_cycle(stats_file)
+
+
+def regenerate(
+    sources: List[ProfileSource],
+    icon_index: IconIndex,
+    targets: List[ProfileTarget],
+    force: bool,
+    target_timeout: float,
+    source_timeout: float,
+) -> bool:
     """
-    source = DistroboxProfileGenerator(current_user)
-    if not source.check_dependencies():
-        logging.error("distrobox: Missing dependencies.")
+    List profiles and write the targets whose inputs changed, for
+    `generate_profiles`. A run with nothing to do leaves the target
+    directories untouched.
+
+    Args:
+        sources (List[ProfileSource]): the sources.
+        icon_index (IconIndex): the icon index shared by the sources.
+        targets (List[ProfileTarget]): the targets.
+        force (bool): regenerate even if the fingerprint matches.
+        target_timeout (float): seconds to wait for each target.
+        source_timeout (float): seconds to wait for each source.
+
+    Returns:
+        bool: True if any target was written, False if all were up to
+              date.
+    """
+    profiles = collect_profiles(sources, source_timeout, SourceCache())
+    if profiles is None:
         exit(1)
-    profiles = source.get_profiles()
-    targets = get_targets(target_query, current_user)
+    profiles = tuple(add_fast_enter_commands(sources, profiles, source_timeout))
+    icon_identity = icon_index.get_identity()
+
+    pending = []
     for t in targets:
+        fingerprint = make_target_fingerprint(profiles, icon_identity, t)
+        if not force and t.get_fingerprint() == fingerprint:
+            logging.info(f"{t.get_target_name()}: inputs unchanged, skipping.")
+            continue
+        pending.append((t, fingerprint))
+    if len(pending) < 1:
+        return False
+
+    results = run_targets(
+        [
+            (t, partial(t.make_targets, list(profiles), fingerprint, force))
+            for t, fingerprint in pending
+        ],
+        target_timeout,
+    )
+    run_post_commit_hooks(get_changed_targets([t for t, _ in pending], results))
+    return True
+
+
+def get_ready_targets(
+    target_query: List[str], current_user: str
+) -> List[ProfileTarget]:
+    """
+    Returns the targets matching a query whose dependencies are
+    satisfied.
+
+    Args:
+        target_query (List[str]): the target query, see `get_targets`.
+        current_user (str): the currently logged-in user.
+
+    Returns:
+        List[ProfileTarget]: the targets.
+    """
+    targets = []
+    for t in get_targets(target_query, current_user):
         if not t.check_dependencies():
-            logging.warn(
+            logging.warning(
                 f"{t.get_target_name()} cannot be run due to missing dependencies."
             )
             continue
-        t.make_targets(profiles)
+        targets.append(t)
+    return targets
+
+
+def get_regeneration_lock(targets: List[ProfileTarget]) -> RegenerationLock:
+    """
+    Returns:
+        RegenerationLock: the lock over the targets' lock files.
+    """
+    return RegenerationLock(
+        [path for t in targets if (path := t.get_lock_path()) is not None]
+    )
 
 
-def watch_journal(callback: Callable) -> None:
+def finish_cycle(stats_file: Optional[Path]) -> Dict[str, float]:
     """
-    Read systemd journal for podman events, and run the callback when
-    a new event occurs.
+    End a regeneration cycle: log its metrics summary, and atomically
+    rewrite the stats file (a Prometheus textfile if it ends in `.prom`,
+    else JSON). The file is world-readable, for collectors running as
+    other users.
 
     Args:
-        callback (Callable): The callback, usually a wrapping of
-                             `generate_profiles`
+        stats_file (Optional[Path]): the stats file, or None.
+
+    Returns:
+        Dict[str, float]: the cycle's figures, see `Metrics.end_cycle`.
     """
-    if not command_exists("journalctl"):
-        logging.fatal("Cannot run watcher: journalctl missing.")
-        exit(1)
-    if not command_exists("podman"):
-        logging.fatal("Cannot run watcher: podman missing.")
-        exit(1)
-    logging.info("Following journal for podman events.")
-    command = [which("journalctl"), "--follow", "--lines", "0", which("podman")]
-    process = Popen(command, stdout=PIPE, stderr=STDOUT, shell=False)
+    cycle = metrics.end_cycle()
+    if stats_file is None:
+        return cycle
     try:
-        for line in process.stdout:
-            line_text = line.decode("utf-8")
-            if "container" not in line_text:
+        write_file_atomically(
+            metrics.format_stats(stats_file), stats_file, STATS_FILE_MODE
+        )
+    except OSError as e:
+        logging.warning(f"Cannot write stats file {str(stats_file)}: {e}")
+    return cycle
+
+
+def run_targets(
+    jobs: List[Tuple[ProfileTarget, Callable[..., MergePlan]]], timeout: float
+) -> Dict[str, Optional[MergePlan]]:
+    """
+    Runs target jobs concurrently on a thread pool. Each job gets its own
+    timeout, and an exception or timeout in one job doesn't affect the
+    others.
+
+    Jobs take a `cancel` keyword argument, which is set once a job times
+    out, so that it stops between files. Timed-out jobs are still waited
+    for before returning, so that no write outlives the regeneration
+    lock held by the caller.
+
+    Args:
+        jobs (List[Tuple[ProfileTarget, Callable[..., MergePlan]]]):
+            targets, and the work to run for each, e.g.
+            `ProfileTarget.make_targets`.
+        timeout (float): seconds to wait for each job, from the start
+                         of the batch.
+
+    Returns:
+        Dict[str, Optional[MergePlan]]: the result of each job by target
+            name, or None if the job failed or timed out.
+    """
+    cancel = Event()
+
+    def timed(job: Callable[..., MergePlan]) -> Tuple[MergePlan, float]:
+        start_time = perf_counter()
+        plan = job(cancel=cancel)
+        return plan, perf_counter() - start_time
+
+    results: Dict[str, Optional[MergePlan]] = {}
+    if len(jobs) < 1:
+        return results
+    executor = ThreadPoolExecutor(
+        max_workers=len(jobs), thread_name_prefix="profile-target"
+    )
+    futures = [(t, executor.submit(timed, job)) for t, job in jobs]
+    deadline = monotonic() + timeout
+    for t, future in futures:
+        name = t.get_target_name()
+        results[name] = None
+        try:
+            plan, elapsed = future.result(timeout=max(deadline - monotonic(), 0))
+        except FutureTimeoutError:
+            logging.error(f"{name}: timed out after {timeout:.1f} s.")
+            continue
+        except Exception:
+            logging.exception(f"{name}: failed.")
+            continue
+        logging.info(f"{name}: finished in {elapsed * 1000:.1f} ms.")
+        results[name] = plan
+    if not all(future.done() for _, future in futures):
+        cancel.set()
+        logging.info("Waiting for timed-out targets to stop.")
+    executor.shutdown(wait=True)
+    return results
+
+
+def get_changed_targets(
+    targets: List[ProfileTarget], results: Dict[str, Optional[MergePlan]]
+) -> List[ProfileTarget]:
+    """
+    Returns the targets whose files a `run_targets` batch changed.
+
+    Args:
+        targets (List[ProfileTarget]): the targets of the batch.
+        results (Dict[str, Optional[MergePlan]]): its results.
+
+    Returns:
+        List[ProfileTarget]: the changed targets.
+    """
+    return [
+        t
+        for t in targets
+        if (plan := results.get(t.get_target_name())) is not None and plan.has_changes()
+    ]
+
+
+def run_post_commit_hooks(targets: List[ProfileTarget]) -> None:
+    """
+    Run the post-commit hooks of the targets changed by a regeneration,
+    each distinct command once, in order.
+
+    Args:
+        targets (List[ProfileTarget]): the changed targets.
+    """
+    commands: Dict[Tuple[str, ...], str] = {}
+    for t in targets:
+        for command in t.get_post_commit_hooks():
+            commands.setdefault(tuple(command), t.get_target_name())
+    with metrics.phase("hooks"):
+        for command, name in commands.items():
+            try:
+                run_command(list(command))
+            except CommandError as e:
+                logging.warning(f"{name}: post-commit hook failed: {e}")
                 continue
-            if "create" in line_text:
-                logging.info("Podman event: distrobox-create likely ran.")
-            if "remove" in line_text:
-                logging.info("Podman event: distrobox-create likely ran.")
-            callback()
-        process.wait()
-    except KeyboardInterrupt:
-        print()
-        logging.info("Watcher interrupted by SIGINT, now exiting.")
-        exit(0)
+            metrics.count("hooks_run")
+            logging.info(f"{name}: ran post-commit hook `{' '.join(command)}`.")
+
+
+def get_event_delta(
+    events: List[Any], running_only: bool = False
+) -> Optional[Dict[str, PodmanEvent]]:
+    """
+    Reduces container events to the latest event per container name,
+    for applying them as per-container deltas. Start and died events
+    don't change Distrobox profiles, which cover stopped containers too.
+
+    Args:
+        events (List[Any]): the events, in order; anything other than a
+                            `PodmanEvent` requires a rescan.
+        running_only (bool): a source only lists running containers, so
+                             start and died events require a rescan.
+
+    Returns:
+        Optional[Dict[str, PodmanEvent]]: the latest create or remove
+            event for each container name, or None if the events cannot
+            be applied as deltas and a full rescan is needed.
+    """
+    latest: Dict[str, PodmanEvent] = {}
+    for e in events:
+        if not isinstance(e, PodmanEvent):
+            return None
+        if e.kind in (EventKind.START, EventKind.DIED):
+            if running_only:
+                return None
+            continue
+        if e.kind == EventKind.RENAME or e.name is None:
+            # The previous name is not part of the event.
+            return None
+        if e.kind == EventKind.CREATE and (e.image is None or len(e.labels) < 1):
+            return None
+        latest[e.name] = e
+    return latest
+
+
+def is_distrobox_event(event: PodmanEvent) -> bool:
+    """
+    Returns:
+        bool: True if the event's labels mark a Distrobox container.
+    """
+    return event.labels.get(DISTROBOX_LABEL[0]) == DISTROBOX_LABEL[1]
+
+
+def make_target_fingerprint(
+    profiles: Sequence[Profile], icon_identity: Any, target: ProfileTarget
+) -> str:
+    """
+    Returns the input fingerprint of a target for a profile listing.
+
+    Args:
+        profiles (Sequence[Profile]): the profile listing.
+        icon_identity (Any): the icon directory identity, see
+                             `IconIndex.get_identity`.
+        target (ProfileTarget): the target.
+
+    Returns:
+        str: the fingerprint.
+    """
+    listing = sorted(
+        (p.to_dict() for p in profiles), key=lambda d: (d["source"], d["name"])
+    )
+    return make_fingerprint(listing, icon_identity, target.get_input_identity())
+
+
+def watch_journal(
+    callback: Callable,
+    quiet_window: float = 2.0,
+    max_delay: float = 10.0,
+    rescan_interval: float = 600.0,
+    watch_paths: Optional[List[Path]] = None,
+    stats_file: Optional[Path] = None,
+    latency_threshold: float = 10.0,
+    after_cursor: Optional[str] = None,
+    get_status: Optional[Callable[[], dict]] = None,
+    classify: Optional[Callable[[PodmanEvent], bool]] = None,
+    event_backend: str = "journal",
+) -> None:
+    """
+    Read systemd journal (or the libpod event stream) for podman container
+    events, and run the callback when a new event occurs. Entries are
+    filtered by journald (or podman) itself and parsed into `PodmanEvent`
+    objects. Changes to
+    `watch_paths` and a periodic timer add `RescanRequest`s. Bursts of
+    events are coalesced into a single callback run by a
+    `RegenerationScheduler`.
+
+    Args:
+        callback (Callable): The callback, usually
+                             `ProfileDaemon.handle_events`; called with
+                             the list of coalesced events and a
+                             cancellation event.
+        quiet_window (float): seconds without events before a burst
+                              triggers the callback.
+        max_delay (float): maximum seconds between the first event of
+                           a burst and the callback.
+        rescan_interval (float): seconds between periodic verifying
+                                 rescans.
+        watch_paths (Optional[List[Path]]): files and directories whose
+                                            changes trigger a rescan.
+        stats_file (Optional[Path]): a file to write metrics to after
+                                     each cycle, see `finish_cycle`.
+        latency_threshold (float): log cycles where the time from a
+                                   journal event to the end of its
+                                   regeneration exceeds this, in seconds.
+        after_cursor (Optional[str]): resume the journal after this
+                                      cursor, catching up on events missed
+                                      while the watcher was down. If None,
+                                      follow new events only, and run a
+                                      startup reconciliation first.
+        get_status (Optional[Callable[[], dict]]): returns the watcher's
+            status for `--status` requests over the IPC socket, usually
+            `ProfileDaemon.get_status`. If None, the socket isn't opened.
+        classify (Optional[Callable[[PodmanEvent], bool]]): returns False
+            for events that can't affect any profile, which are dropped
+            before reaching the scheduler, usually
+            `ContainerClassifier.classify`. If None, no events are dropped.
+        event_backend (str): "journal", "libpod", or "auto", see
+                             `get_event_backend`. libpod events have no
+                             cursor, so `after_cursor` is ignored with it.
+    """
+    event_backend = get_event_backend(event_backend)
+    if event_backend == "libpod":
+        if not socket_exists():
+            logging.fatal("Cannot run watcher: podman API socket missing.")
+            exit(1)
+        after_cursor = None
+    else:
+        if not command_exists("journalctl"):
+            logging.fatal("Cannot run watcher: journalctl missing.")
+            exit(1)
+        if not command_exists("podman"):
+            logging.fatal("Cannot run watcher: podman missing.")
+            exit(1)
+    # Events replayed from `after_cursor` happened while the watcher was
+    # down; they are left out of the latency measurements.
+    start_time = time()
+
+    def run_cycle(batch: List[Any], cancel: Event) -> None:
+        metrics.begin_cycle()
+        latencies = []
+        try:
+            callback(batch, cancel)
+            metrics.count("events_coalesced", len(batch) - 1)
+            latencies = get_event_latencies(batch, time(), start_time)
+            for latency in latencies:
+                metrics.record_latency(latency)
+        except Cancelled:
+            raise
+        except Exception as e:
+            complete_requests(batch, {"ok": False, "error": str(e)})
+            raise
+        finally:
+            cycle = finish_cycle(stats_file)
+        complete_requests(batch, {"ok": True, "cycle": cycle})
+        if len(latencies) > 0 and max(latencies) > latency_threshold:
+            logging.warning(
+                f"Event-to-profile latency {max(latencies):.2f} s is over "
+                f"{latency_threshold:.2f} s; waited "
+                f"{max(latencies) - cycle['duration_seconds']:.2f} s, then "
+                f"cycle: {format_cycle(cycle)}."
+            )
+
+    scheduler = RegenerationScheduler(run_cycle, quiet_window, max_delay)
+    scheduler.start()
+    if after_cursor is None:
+        scheduler.notify(RescanRequest("startup reconciliation"))
+    try:
+        exit_code = asyncio.run(
+            watch_events(
+                scheduler,
+                rescan_interval,
+                watch_paths or [],
+                after_cursor,
+                get_status,
+                classify,
+                event_backend,
+            )
+        )
+    finally:
+        scheduler.stop()
+    exit(exit_code)
+
+
+def get_event_latencies(
+    events: List[Any], now: float, since: Optional[float] = None
+) -> List[float]:
+    """
+    Returns the time from each timestamped Podman event in a batch to
+    `now`, i.e. to the end of the regeneration that handled it.
+
+    Args:
+        events (List[Any]): the batch.
+        now (float): the wall-clock end of the regeneration.
+        since (Optional[float]): skip events timestamped before this
+                                 wall-clock time, e.g. catch-up events
+                                 from before the watcher started.
+
+    Returns:
+        List[float]: the latencies, in seconds.
+    """
+    return [
+        max(now - e.timestamp, 0.0)
+        for e in events
+        if isinstance(e, PodmanEvent)
+        and e.timestamp is not None
+        and (since is None or e.timestamp >= since)
+    ]
+
+
+async def watch_events(
+    scheduler: RegenerationScheduler,
+    rescan_interval: float,
+    watch_paths: List[Path],
+    after_cursor: Optional[str] = None,
+    get_status: Optional[Callable[[], dict]] = None,
+    classify: Optional[Callable[[PodmanEvent], bool]] = None,
+    event_backend: str = "journal",
+) -> int:
+    """
+    Event loop for `watch_journal`: multiplexes the journal subprocess (or
+    libpod event stream), inotify watches, the IPC socket, the rescan
+    timer and termination signals, feeding events into the scheduler.
+
+    If journalctl rejects `after_cursor` (e.g. the journal was vacuumed
+    past it) before producing any entry, it is restarted from the end of
+    the journal, and a rescan is requested instead.
+
+    Returns:
+        int: the exit code for the watcher.
+    """
+    loop = asyncio.get_running_loop()
+    stop_signal = loop.create_future()
+    for sig in (SIGINT, SIGTERM):
+        loop.add_signal_handler(sig, stop_signal.set_result, sig)
+
+    timer = asyncio.create_task(rescan_periodically(scheduler, rescan_interval))
+    inotify = watch_files(loop, scheduler, watch_paths)
+    server = None
+    if get_status is not None:
+        server = await start_server(scheduler.notify, get_status)
+    process = None
+    if event_backend == "libpod":
+        journal = asyncio.create_task(read_libpod_events(scheduler, classify))
+    else:
+        process = await start_journal(after_cursor)
+        journal = asyncio.create_task(read_journal(process.stdout, scheduler, classify))
+    try:
+        while True:
+            await asyncio.wait([journal, stop_signal], return_when=FIRST_COMPLETED)
+            if (
+                stop_signal.done()
+                or process is None
+                or after_cursor is None
+                or journal.result() > 0
+            ):
+                break
+            if await process.wait() == 0:
+                break
+            logging.warning(
+                "Cannot resume the journal at the saved cursor, rescanning instead."
+            )
+            scheduler.notify(RescanRequest("journal cursor unavailable"))
+            after_cursor = None
+            process = await start_journal(after_cursor)
+            journal = asyncio.create_task(
+                read_journal(process.stdout, scheduler, classify)
+            )
+    finally:
+        timer.cancel()
+        journal.cancel()
+        if inotify is not None:
+            loop.remove_reader(inotify.fd)
+            inotify.close()
+        if server is not None:
+            stop_server(server)
+        if process is not None:
+            if process.returncode is None:
+                process.terminate()
+            await process.wait()
+
+    if stop_signal.done():
+        logging.info(
+            f"Watcher interrupted by {stop_signal.result().name}, now exiting."
+        )
+        return 0
+    if process is None:
+        logging.error("The podman event stream ended unexpectedly.")
+    else:
+        logging.error(f"journalctl exited unexpectedly ({process.returncode}).")
+    return 1
+
+
+def get_event_backend(event_backend: str) -> str:
+    """
+    Resolve the "auto" event backend: the journal if journalctl is
+    available, as it allows resuming from a cursor, else the libpod event
+    stream if the podman socket exists.
+
+    Args:
+        event_backend (str): "journal", "libpod", or "auto".
+
+    Returns:
+        str: "journal" or "libpod".
+    """
+    if event_backend != "auto":
+        return event_backend
+    if not command_exists("journalctl") and socket_exists():
+        return "libpod"
+    return "journal"
+
+
+async def start_journal(after_cursor: Optional[str]) -> asyncio.subprocess.Process:
+    """
+    Start following the journal for podman container events.
+
+    Args:
+        after_cursor (Optional[str]): start after this journal cursor, or
+                                      at the end of the journal if None.
+
+    Returns:
+        asyncio.subprocess.Process: the journalctl process, with its
+                                    output piped.
+    """
+    if after_cursor is None:
+        logging.info("Following journal for podman events.")
+        position = ["--lines", "0"]
+    else:
+        logging.info("Following journal for podman events, after saved cursor.")
+        position = [f"--after-cursor={after_cursor}"]
+    command = [
+        which("journalctl"),
+        "--follow",
+        *position,
+        "--output",
+        "json",
+        f"--output-fields={','.join(JOURNAL_FIELDS)}",
+        *get_journal_matches(),
+    ]
+    return await asyncio.create_subprocess_exec(*command, stdout=PIPE)
+
+
+async def read_journal(
+    stream: asyncio.StreamReader,
+    scheduler: RegenerationScheduler,
+    classify: Optional[Callable[[PodmanEvent], bool]] = None,
+) -> int:
+    """
+    Parse journal entries from a `journalctl --output json` stream into
+    the scheduler, until the stream ends.
+
+    Args:
+        stream (asyncio.StreamReader): the journalctl output.
+        scheduler (RegenerationScheduler): the scheduler.
+        classify (Optional[Callable[[PodmanEvent], bool]]): drops events
+                                                            it returns
+                                                            False for.
+
+    Returns:
+        int: the number of lines read.
+    """
+    lines = 0
+    while len(line := await stream.readline()) > 0:
+        lines += 1
+        event = parse_journal_entry(line)
+        if event is not None:
+            queue_event(event, scheduler, classify)
+    return lines
+
+
+async def read_libpod_events(
+    scheduler: RegenerationScheduler,
+    classify: Optional[Callable[[PodmanEvent], bool]] = None,
+) -> int:
+    """
+    Feed events from the libpod `/events` stream into the scheduler,
+    until podman closes it.
+
+    Args:
+        scheduler (RegenerationScheduler): the scheduler.
+        classify (Optional[Callable[[PodmanEvent], bool]]): drops events
+                                                            it returns
+                                                            False for.
+
+    Returns:
+        int: the number of events read.
+    """
+    count = 0
+    socket_path = get_podman_socket_path()
+    if socket_path is None:
+        return count
+    try:
+        async for event in stream_events(socket_path, since=time()):
+            count += 1
+            queue_event(event, scheduler, classify)
+    except (OSError, LibpodError) as e:
+        logging.error(f"Cannot follow podman events: {e}")
+    return count
+
+
+def queue_event(
+    event: PodmanEvent,
+    scheduler: RegenerationScheduler,
+    classify: Optional[Callable[[PodmanEvent], bool]] = None,
+) -> None:
+    """
+    Count an event, and pass it to the scheduler unless it's dropped.
+
+    Args:
+        event (PodmanEvent): the event.
+        scheduler (RegenerationScheduler): the scheduler.
+        classify (Optional[Callable[[PodmanEvent], bool]]): drops events
+                                                            it returns
+                                                            False for.
+    """
+    metrics.count("events_received")
+    if classify is not None and not classify(event):
+        return
+    logging.info(f"Podman event: {event.kind.value} {event.name or event.container_id}")
+    scheduler.notify(event)
+
+
+async def rescan_periodically(
+    scheduler: RegenerationScheduler, rescan_interval: float
+) -> None:
+    """
+    Request a verifying rescan every `rescan_interval` seconds.
+    """
+    while True:
+        await asyncio.sleep(rescan_interval)
+        scheduler.notify(RescanRequest("periodic rescan", verify=True))
+
+
+def watch_files(
+    loop: asyncio.AbstractEventLoop,
+    scheduler: RegenerationScheduler,
+    watch_paths: List[Path],
+) -> Optional[Inotify]:
+    """
+    Register inotify watches with the event loop, requesting a rescan
+    when a watched file, or anything in a watched directory, changes.
+    Files (and directories that don't exist yet) are watched through
+    their parent directory, so that they can be created or replaced by
+    renames.
+
+    Returns:
+        Optional[Inotify]: the inotify instance, or None if unavailable.
+    """
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError) as e:
+        logging.warning(f"Cannot watch files for changes: {e}")
+        return None
+    watched_dirs = {p for p in watch_paths if p.is_dir()}
+    watched_files = set(watch_paths) - watched_dirs
+    for d in watched_dirs | {p.parent for p in watched_files}:
+        try:
+            inotify.add_watch(d)
+            logging.info(f"Watching {str(d)} for changes.")
+        except OSError as e:
+            logging.info(f"Cannot watch {str(d)}: {e}")
+
+    def on_readable() -> None:
+        for e in inotify.read_events():
+            if e.path in watched_files or e.path.parent in watched_dirs:
+                logging.info(f"File changed: {str(e.path)}")
+                scheduler.notify(RescanRequest(f"{str(e.path)} changed"))
+
+    loop.add_reader(inotify.fd, on_readable)
+    return inotify
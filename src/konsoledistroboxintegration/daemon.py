@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+daemon.py: long-lived profile state for watch mode.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+from pathlib import Path
+from functools import partial
+from threading import Event
+
+from konsoledistroboxintegration.commands import check_cancelled
+from konsoledistroboxintegration.core import (
+    get_changed_targets,
+    get_event_delta,
+    get_ready_sources,
+    get_ready_targets,
+    get_regeneration_lock,
+    is_distrobox_event,
+    make_target_fingerprint,
+    run_post_commit_hooks,
+    run_targets,
+)
+from konsoledistroboxintegration.files import MergePlan, get_file_identity
+from konsoledistroboxintegration.events import EventKind, PodmanEvent, RescanRequest
+from konsoledistroboxintegration.icons import IconIndex
+from konsoledistroboxintegration.manifests import make_fingerprint
+from konsoledistroboxintegration.metrics import metrics
+from konsoledistroboxintegration.profiles import Profile
+from konsoledistroboxintegration.relevance import ContainerClassifier
+from konsoledistroboxintegration.sources import (
+    DistroboxProfileGenerator,
+    PodmanProfileGenerator,
+    SourceCache,
+    ToolboxProfileGenerator,
+    add_fast_enter_commands,
+    collect_profiles,
+)
+from konsoledistroboxintegration.targets import ProfileTarget
+
+
+class RescanError(Exception):
+    """
+    Raised when a rescan can't list containers; the current profiles are
+    kept.
+    """
+
+
+class ProfileDaemon:
+    """
+    In-memory model of the generated profiles, for watch mode.
+
+    The sources, targets, icon index and dependency probes are set up once.
+    Each batch of events is then reconciled against the current profile
+    set, so only profiles that actually changed are rendered or written.
+    """
+
+    def __init__(
+        self,
+        current_user: str,
+        target_query: List[str],
+        source_query: List[str],
+        backend: str,
+        target_timeout: float = 30.0,
+        source_timeout: float = 10.0,
+        fast_enter: bool = False,
+    ):
+        """
+        Args:
+            current_user (str): the currently logged-in user.
+            target_query (List[str]): the target query, as in
+                                      `generate_profiles`.
+            source_query (List[str]): the source query, as in
+                                      `generate_profiles`.
+            backend (str): the Distrobox listing backend, see
+                           `get_distrobox_source`.
+            target_timeout (float): seconds to wait for each target.
+            source_timeout (float): seconds to wait for each source.
+            fast_enter (bool): give Distrobox profiles fast-enter
+                               commands, see `EnterCommandCache`.
+        """
+        self.target_timeout = target_timeout
+        self.source_timeout = source_timeout
+        self.icon_index = IconIndex()
+        self.source_cache = SourceCache()
+        self.sources = get_ready_sources(
+            source_query, current_user, backend, self.icon_index, fast_enter
+        )
+        # Container events can only be applied as deltas for Distrobox;
+        # other container sources need a rescan.
+        self.distrobox: Optional[DistroboxProfileGenerator] = None
+        self.other_containers = False
+        # Whether a source only lists running containers, so that starting
+        # or stopping a container changes its profiles.
+        self.running_only = False
+        for source in self.sources:
+            if isinstance(source, DistroboxProfileGenerator):
+                self.distrobox = source
+            elif isinstance(source, (ToolboxProfileGenerator, PodmanProfileGenerator)):
+                self.other_containers = True
+            if isinstance(source, PodmanProfileGenerator):
+                self.running_only = True
+        # Events of other containers can only be told apart, and dropped,
+        # when Distrobox is the only container source.
+        self.classifier: Optional[ContainerClassifier] = None
+        if self.distrobox is not None and not self.other_containers:
+            self.classifier = ContainerClassifier()
+        self.targets: List[ProfileTarget] = get_ready_targets(
+            target_query, current_user
+        )
+        self.lock = get_regeneration_lock(self.targets)
+        # Current profiles by root name; None until the first rescan.
+        self.profiles: Optional[Dict[str, Profile]] = None
+        # Target input identities at the last full write, by target name.
+        self.identities: Dict[str, Any] = {}
+        # Journal cursor of the last event handled by this process.
+        self.cursor: Optional[str] = None
+        # Targets changed by the current regeneration, by target name.
+        self.changed: Dict[str, ProfileTarget] = {}
+
+    def get_watch_paths(self) -> List[Path]:
+        """
+        Returns:
+            List[Path]: files and directories whose changes affect the
+                        generated profiles.
+        """
+        return [
+            *self.icon_index.dirs,
+            *[p for s in self.sources for p in s.get_watch_paths()],
+            *[p for t in self.targets for p in t.get_watch_paths()],
+        ]
+
+    def get_status(self) -> dict:
+        """
+        Returns:
+            dict: a JSON-serialisable summary of the watcher's state, for
+                  `--status`.
+        """
+        profiles = self.profiles
+        return {
+            "sources": [s.get_source_name() for s in self.sources],
+            "targets": [t.get_target_name() for t in self.targets],
+            "profiles": (sorted(profiles.keys()) if profiles is not None else None),
+            "cursor": self.cursor,
+            "metrics": metrics.to_dict(),
+        }
+
+    def get_state_fingerprint(self, target: ProfileTarget) -> str:
+        """
+        Returns a fingerprint of the inputs, besides journal events, that
+        the model depends on: the sources and their configuration files,
+        the icon directories and the target's own inputs.
+
+        Args:
+            target (ProfileTarget): the target.
+
+        Returns:
+            str: the fingerprint.
+        """
+        return make_fingerprint(
+            sorted(s.get_source_name() for s in self.sources),
+            [get_file_identity(p) for s in self.sources for p in s.get_watch_paths()],
+            self.icon_index.get_identity(),
+            target.get_input_identity(),
+        )
+
+    def resume(self) -> Optional[str]:
+        """
+        Restore the model from the targets' manifests, if every target
+        saved the same journal cursor with unchanged inputs.
+
+        Returns:
+            Optional[str]: the journal cursor to resume after, or None if
+                           the model couldn't be restored and a startup
+                           reconciliation is needed.
+        """
+        cursors = set()
+        profiles: Optional[Dict[str, Profile]] = None
+        for t in self.targets:
+            state = t.get_cursor()
+            if state is None or state[1] != self.get_state_fingerprint(t):
+                return None
+            listing = t.get_profiles()
+            if listing is None:
+                return None
+            held = {p.get_root_name(): p for p in listing}
+            if profiles is not None and held != profiles:
+                return None
+            cursors.add(state[0])
+            profiles = held
+        if profiles is None or len(cursors) != 1:
+            return None
+        self.profiles = profiles
+        self.fill_classifier(profiles.values())
+        self.identities = {
+            t.get_target_name(): t.get_input_identity() for t in self.targets
+        }
+        logging.info(f"Restored {len(profiles)} profile(s) from manifests.")
+        return cursors.pop()
+
+    def fill_classifier(self, profiles: Iterable[Profile]) -> None:
+        """
+        Record the Distrobox containers of a full listing in the
+        relevance cache, if there is one.
+
+        Args:
+            profiles (Iterable[Profile]): the profiles of every source.
+        """
+        if self.classifier is None or self.distrobox is None:
+            return
+        name = self.distrobox.get_source_name()
+        self.classifier.fill(p.uid for p in profiles if p.source == name)
+
+    def save_cursor(self, events: List[Any]) -> None:
+        """
+        Record the journal cursor of the last event in a handled batch
+        next to each target's manifest.
+
+        Args:
+            events (List[Any]): the batch.
+        """
+        cursors = [
+            e.cursor
+            for e in events
+            if isinstance(e, PodmanEvent) and e.cursor is not None
+        ]
+        if len(cursors) > 0:
+            self.cursor = cursors[-1]
+        if self.cursor is None or self.profiles is None:
+            return
+        for t in self.targets:
+            try:
+                t.save_cursor(self.cursor, self.get_state_fingerprint(t))
+            except OSError as e:
+                logging.warning(f"{t.get_target_name()}: cannot save cursor: {e}")
+
+    def handle_events(self, events: List[Any], cancel: Optional[Event] = None) -> None:
+        """
+        Scheduler callback: apply events as deltas where possible, else
+        rescan all containers.
+
+        Cancellation is checked before anything is written; once targets
+        are being written, the regeneration runs to completion. The
+        targets' lock files are held throughout, so that other processes
+        wait for the regeneration and can reuse it.
+
+        Args:
+            events (List[Any]): the coalesced `PodmanEvent`s and
+                                `RescanRequest`s.
+            cancel (Optional[Event]): abandons the regeneration, raising
+                                      `Cancelled`, when set.
+        """
+        verify = any(isinstance(e, RescanRequest) and e.verify for e in events)
+        self.lock.acquire(cancel)
+        try:
+            if verify or not self.apply_events(events, cancel):
+                self.rescan(verify, cancel)
+            self.save_cursor(events)
+        finally:
+            run_post_commit_hooks(list(self.changed.values()))
+            self.changed = {}
+            self.lock.release()
+
+    def apply_events(self, events: List[Any], cancel: Optional[Event] = None) -> bool:
+        """
+        Apply container events as per-container deltas to the model and
+        the targets, without listing containers.
+
+        Args:
+            events (List[Any]): the events, in order.
+            cancel (Optional[Event]): abandons the update when set.
+
+        Returns:
+            bool: True if applied, False if a rescan is needed instead.
+        """
+        if self.profiles is None or self.distrobox is None:
+            return False
+        latest = get_event_delta(events, self.running_only)
+        if latest is None:
+            return False
+        if self.other_containers and not all(
+            is_distrobox_event(e) for e in latest.values()
+        ):
+            return False
+        self.icon_index.refresh()
+        profiles = dict(self.profiles)
+        created = []
+        for name, e in latest.items():
+            if e.kind == EventKind.REMOVE or not is_distrobox_event(e):
+                profile = self.distrobox.make_profile(name, e.image)
+                profiles.pop(profile.get_root_name(), None)
+            else:
+                created.append(
+                    self.distrobox.make_profile(name, e.image, e.container_id)
+                )
+        for profile in self.distrobox.add_fast_enter(
+            created, self.source_timeout, cancel
+        ):
+            profiles[profile.get_root_name()] = profile
+        check_cancelled(cancel)
+        return self.reconcile(profiles, fingerprints=None)
+
+    def rescan(self, verify: bool = False, cancel: Optional[Event] = None) -> None:
+        """
+        Collect all sources and reconcile the result against the model.
+        Raises `RescanError` if listing failed, so that the batch (and any
+        refresh request in it) is reported as failed.
+
+        Args:
+            verify (bool): rewrite every target from scratch, checking
+                           files on disk instead of trusting the model.
+            cancel (Optional[Event]): abandons the rescan when set.
+        """
+        collected = collect_profiles(
+            self.sources, self.source_timeout, self.source_cache, cancel
+        )
+        if collected is None:
+            raise RescanError("Rescan failed, keeping current profiles.")
+        collected = add_fast_enter_commands(
+            self.sources, collected, self.source_timeout, cancel
+        )
+        profiles = {p.get_root_name(): p for p in collected}
+        self.fill_classifier(collected)
+        icon_identity = self.icon_index.get_identity()
+        fingerprints = {
+            t.get_target_name(): make_target_fingerprint(collected, icon_identity, t)
+            for t in self.targets
+        }
+        check_cancelled(cancel)
+        if verify or not self.reconcile(profiles, fingerprints):
+            self.rebuild(profiles, fingerprints, verify)
+
+    def reconcile(
+        self,
+        profiles: Dict[str, Profile],
+        fingerprints: Optional[Dict[str, str]],
+    ) -> bool:
+        """
+        Apply the difference between the model and a new profile set to
+        every target, then adopt the new set as the model.
+
+        Args:
+            profiles (Dict[str, Profile]): the new profiles, by root name.
+            fingerprints (Optional[Dict[str, str]]): input fingerprints for
+                the new set by target name, if known.
+
+        Returns:
+            bool: True if applied, False if a target needs `rebuild`.
+        """
+        if self.profiles is None:
+            return False
+        for t in self.targets:
+            if self.identities.get(t.get_target_name()) != t.get_input_identity():
+                return False
+        updated = [p for k, p in profiles.items() if self.profiles.get(k) != p]
+        removed = [p for k, p in self.profiles.items() if k not in profiles]
+        if len(updated) + len(removed) > 0:
+            results = run_targets(
+                [
+                    (
+                        t,
+                        partial(
+                            t.apply_delta,
+                            updated,
+                            removed,
+                            (fingerprints or {}).get(t.get_target_name()),
+                        ),
+                    )
+                    for t in self.targets
+                ],
+                self.target_timeout,
+            )
+            self.record_changes(results)
+            if any(plan is None for plan in results.values()):
+                return False
+        self.profiles = profiles
+        return True
+
+    def rebuild(
+        self,
+        profiles: Dict[str, Profile],
+        fingerprints: Dict[str, str],
+        verify: bool = False,
+    ) -> None:
+        """
+        Write every target against its manifest, and adopt the profile set
+        as the model.
+
+        Args:
+            profiles (Dict[str, Profile]): the profiles, by root name.
+            fingerprints (Dict[str, str]): input fingerprints by target name.
+            verify (bool): check every file on disk, instead of trusting
+                           the manifests.
+        """
+        for t in self.targets:
+            self.identities[t.get_target_name()] = t.get_input_identity()
+        results = run_targets(
+            [
+                (
+                    t,
+                    partial(
+                        t.make_targets,
+                        list(profiles.values()),
+                        fingerprints[t.get_target_name()],
+                        verify,
+                    ),
+                )
+                for t in self.targets
+            ],
+            self.target_timeout,
+        )
+        self.record_changes(results)
+        self.profiles = profiles
+
+    def record_changes(self, results: Dict[str, Optional[MergePlan]]) -> None:
+        """
+        Note the targets a `run_targets` batch changed, for running their
+        post-commit hooks once the regeneration is done.
+
+        Args:
+            results (Dict[str, Optional[MergePlan]]): the batch's results.
+        """
+        for t in get_changed_targets(self.targets, results):
+            self.changed[t.get_target_name()] = t
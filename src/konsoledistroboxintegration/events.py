@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+events.py: typed podman container events, and parsing them from
+           journald JSON entries and libpod API events.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import json
+import logging
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional
+from dataclasses import dataclass, field
+from concurrent.futures import Future
+
+
+class EventKind(Enum):
+    CREATE = "create"
+    REMOVE = "remove"
+    RENAME = "rename"
+    START = "start"
+    DIED = "died"
+
+
+@dataclass
+class PodmanEvent:
+    kind: EventKind
+    container_id: str
+    name: Optional[str]
+    image: Optional[str]
+    timestamp: Optional[float] = None
+    cursor: Optional[str] = None
+    labels: Dict[str, str] = field(default_factory=dict)
+
+
+class RescanRequest(NamedTuple):
+    """
+    A non-podman reason to list all containers again, e.g. a changed
+    configuration file or a periodic timer. With `verify`, targets are
+    rewritten from scratch instead of trusting in-memory state. If
+    `reply` is set, it is resolved with a result dict once the
+    regeneration handling the request finishes.
+    """
+
+    reason: str
+    verify: bool = False
+    reply: Optional[Future] = None
+
+
+# Attributes of libpod events that aren't container labels.
+LIBPOD_ATTRIBUTES = {"name", "image", "containerExitCode", "podId"}
+# Fields requested from journalctl; anything else podman logs is never
+# serialised or decoded.
+JOURNAL_FIELDS = [
+    "PODMAN_EVENT",
+    "PODMAN_TYPE",
+    "PODMAN_ID",
+    "PODMAN_NAME",
+    "PODMAN_IMAGE",
+    "PODMAN_LABELS",
+]
+
+
+def get_journal_matches() -> List[str]:
+    """
+    Returns journalctl match arguments selecting podman container events
+    of the kinds in `EventKind`. Matches on the same field are OR'ed by
+    journald, different fields are AND'ed.
+
+    Returns:
+        List[str]: the match arguments, in `FIELD=value` form.
+    """
+    return [
+        "SYSLOG_IDENTIFIER=podman",
+        "PODMAN_TYPE=container",
+        *[f"PODMAN_EVENT={k.value}" for k in EventKind],
+    ]
+
+
+def get_journal_value(entry: dict, key: str) -> Optional[str]:
+    """
+    Read a field from a journald JSON entry. Fields may be serialised
+    as strings, as byte arrays (non-UTF-8 data), or as lists of either
+    (repeated fields), in which case the first value is returned.
+
+    Args:
+        entry (dict): the decoded JSON entry.
+        key (str): the field name.
+
+    Returns:
+        Optional[str]: the field value, or None if missing.
+    """
+    value = entry.get(key)
+    if isinstance(value, list) and len(value) > 0 and not isinstance(value[0], int):
+        value = value[0]
+    if isinstance(value, list):
+        return bytes(value).decode("utf-8", errors="replace")
+    return value
+
+
+def parse_journal_entry(line: bytes) -> Optional[PodmanEvent]:
+    """
+    Parse a line of `journalctl --output json` into a PodmanEvent.
+
+    Args:
+        line (bytes): the raw output line.
+
+    Returns:
+        Optional[PodmanEvent]: the event, or None if the line is not
+                               a container event of a known kind.
+    """
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        logging.warning(f"Skipping malformed journal entry: {line!r}")
+        return None
+    if get_journal_value(entry, "PODMAN_TYPE") != "container":
+        return None
+    try:
+        kind = EventKind(get_journal_value(entry, "PODMAN_EVENT"))
+    except ValueError:
+        return None
+    container_id = get_journal_value(entry, "PODMAN_ID")
+    if container_id is None:
+        return None
+    labels = {}
+    if (raw_labels := get_journal_value(entry, "PODMAN_LABELS")) is not None:
+        try:
+            labels = json.loads(raw_labels)
+        except ValueError:
+            pass
+        if not isinstance(labels, dict):
+            labels = {}
+    timestamp = get_journal_value(entry, "__REALTIME_TIMESTAMP")
+    return PodmanEvent(
+        kind=kind,
+        container_id=container_id,
+        name=get_journal_value(entry, "PODMAN_NAME"),
+        image=get_journal_value(entry, "PODMAN_IMAGE"),
+        timestamp=int(timestamp) / 1_000_000 if timestamp is not None else None,
+        cursor=get_journal_value(entry, "__CURSOR"),
+        labels=labels,
+    )
+
+
+def parse_libpod_event(line: bytes) -> Optional[PodmanEvent]:
+    """
+    Parse a line of the libpod `/events` stream into a PodmanEvent.
+    libpod reports container labels among the event attributes.
+
+    Args:
+        line (bytes): the raw event line.
+
+    Returns:
+        Optional[PodmanEvent]: the event, or None if the line is not
+                               a container event of a known kind.
+    """
+    if len(line.strip()) < 1:
+        return None
+    try:
+        entry = json.loads(line)
+        event_type = entry.get("Type")
+        action = entry.get("Action") or entry.get("Status")
+        container_id = str(entry["Actor"]["ID"])
+        attributes = dict(entry["Actor"].get("Attributes") or {})
+    except (ValueError, KeyError, TypeError, AttributeError):
+        logging.warning(f"Skipping malformed podman event: {line!r}")
+        return None
+    if event_type != "container":
+        return None
+    try:
+        kind = EventKind(action)
+    except ValueError:
+        return None
+    time_nano = entry.get("timeNano")
+    return PodmanEvent(
+        kind=kind,
+        container_id=container_id,
+        name=attributes.get("name"),
+        image=attributes.get("image"),
+        timestamp=time_nano / 1_000_000_000 if time_nano is not None else None,
+        labels={k: v for k, v in attributes.items() if k not in LIBPOD_ATTRIBUTES},
+    )
@@ -13,9 +13,107 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
+import os
+import stat
 import logging
-from typing import Optional, NamedTuple, List
+from typing import Optional, NamedTuple, List, Tuple
 from pathlib import Path
+from tempfile import mkstemp
+from threading import Event
+
+from konsoledistroboxintegration.commands import check_cancelled
+from konsoledistroboxintegration.metrics import metrics
+
+
+def get_default_mode() -> int:
+    """
+    Returns:
+        int: the mode `open` gives new files under the current umask.
+    """
+    # Setting the umask to read it races with other threads creating
+    # files, so read it from /proc where the kernel reports it.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def get_file_mode(filepath: Path) -> int:
+    """
+    Args:
+        filepath (Path): the file path.
+
+    Returns:
+        int: the permission bits of the file, or the default mode for
+             new files if it doesn't exist.
+    """
+    try:
+        return stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        return get_default_mode()
+
+
+def stage_file(content: str, filepath: Path, mode: Optional[int] = None) -> Path:
+    """
+    Write contents to a temporary file next to the target path and flush
+    it to disk, ready to be renamed over the target.
+
+    Args:
+        content (str): the file contents.
+        filepath (Path): the eventual target file path.
+        mode (Optional[int]): the file mode; if None, the target's mode,
+                              or the default mode for new files.
+
+    Returns:
+        Path: the temporary file path.
+    """
+    fd, temp_path = mkstemp(dir=filepath.parent, prefix=f".{filepath.name}.")
+    try:
+        os.fchmod(fd, get_file_mode(filepath) if mode is None else mode)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return Path(temp_path)
+
+
+def sync_directory(path: Path) -> None:
+    """
+    Flush directory entries (e.g. renames and deletions) to disk.
+
+    Args:
+        path (Path): the directory.
+    """
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_file_atomically(
+    content: str, filepath: Path, mode: Optional[int] = None
+) -> None:
+    """
+    Write contents to a file through a temporary file and a rename, so
+    readers never see a partially written file.
+
+    Args:
+        content (str): the file contents.
+        filepath (Path): the target file path.
+        mode (Optional[int]): the file mode, see `stage_file`.
+    """
+    os.replace(stage_file(content, filepath, mode), filepath)
+    sync_directory(filepath.parent)
 
 
 def write_file_sparingly(
@@ -49,8 +147,26 @@ def write_file_sparingly(
             if saved_content_trimmed == content_trimmed:
                 logging.info(f"File {str(filepath)} unchanged - skipping writing...")
                 return
-    with open(filepath, "w") as fw:
-        fw.write(content)
+    write_file_atomically(content, filepath)
+
+
+def get_file_identity(path: Path) -> Optional[Tuple[int, int, int]]:
+    """
+    Returns an identity for a file's current contents: its inode,
+    modification time and size.
+
+    Args:
+        path (Path): the file path.
+
+    Returns:
+        Optional[Tuple[int, int, int]]: the identity, or None if the
+                                        file doesn't exist.
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
 
 def directory_exists(path: Path) -> bool:
@@ -71,10 +187,64 @@ class FileSpec(NamedTuple):
     path: Path
 
 
-def merge_file_tree(root: Path, glob: str, specs: List[FileSpec]) -> None:
+class MergePlan(NamedTuple):
+    add: List[Path]
+    update: List[Path]
+    delete: List[Path]
+    unchanged: List[Path]
+
+    def has_changes(self) -> bool:
+        """
+        Returns:
+            bool: True if the plan adds, updates or deletes any file.
+        """
+        return len(self.add) + len(self.update) + len(self.delete) > 0
+
+
+def plan_file_tree(root: Path, glob: str, specs: List[FileSpec]) -> MergePlan:
+    """
+    Compare a tree of files (defined in FileSpec) against the root
+    directory, without changing anything.
+
+    Args:
+        root (Path): the root directory.
+        glob (str): the glob of existing files to match.
+        specs (List[FileSpec]): The filepath and contents to write.
+
+    Returns:
+        MergePlan: files to add, update and delete, and files that
+                   already have the right contents.
+    """
+    current_filetree = {fn for fn in root.glob(glob) if fn.is_file()}
+    new_filetree = {s.path: s.content for s in specs}
+
+    add, update, unchanged = [], [], []
+    for path, content in new_filetree.items():
+        if path not in current_filetree:
+            add.append(path)
+            continue
+        try:
+            with open(path, "r") as f:
+                saved_content = f.read()
+        except (OSError, UnicodeDecodeError):
+            saved_content = None
+        (unchanged if saved_content == content else update).append(path)
+    delete = [fn for fn in current_filetree if fn not in new_filetree]
+    return MergePlan(
+        add=sorted(add),
+        update=sorted(update),
+        delete=sorted(delete),
+        unchanged=sorted(unchanged),
+    )
+
+
+def merge_file_tree(
+    root: Path, glob: str, specs: List[FileSpec], cancel: Optional[Event] = None
+) -> MergePlan:
     """
     Write a tree of files (defined in Filespec) to the root directory,
-    and deletes stray files (as defined in `glob`).
+    and deletes stray files (as defined in `glob`), via
+    `apply_merge_plan`.
 
     Args:
         root (Path): the root directory.
@@ -82,26 +252,74 @@ def merge_file_tree(root: Path, glob: str, specs: List[FileSpec]) -> None:
                     in `root` matches but isn't accounted for in
                     `specs`, it is deleted.
         specs (List[FileSpec]): The filepath and contents to write.
+        cancel (Optional[Event]): stops writing, see `apply_merge_plan`.
+
+    Returns:
+        MergePlan: the changes that were applied.
+    """
+    plan = plan_file_tree(root, glob, specs)
+    apply_merge_plan(root, plan, specs, cancel)
+    return plan
+
+
+def apply_merge_plan(
+    root: Path,
+    plan: MergePlan,
+    specs: List[FileSpec],
+    cancel: Optional[Event] = None,
+) -> None:
     """
-    current_filetree = [fn for fn in root.glob(glob) if fn.is_file()]
+    Apply a MergePlan to the root directory. All new contents are
+    staged in temporary files first, then renamed into place, and the
+    directory is flushed once for the whole batch.
 
-    new_filetree = [s.path for s in specs]
-    logging.info("Files to create/update:")
-    if len(new_filetree) < 1:
-        logging.info("  (none)")
-    for f in new_filetree:
-        logging.info(f"  - {str(f)}")
+    Args:
+        root (Path): the root directory.
+        plan (MergePlan): the plan to apply.
+        specs (List[FileSpec]): the contents for the added and updated
+                                paths in the plan.
+        cancel (Optional[Event]): stops writing, raising `Cancelled`,
+                                  when set; checked between files, so the
+                                  plan may be left partially applied.
+    """
+    for label, paths in [
+        ("Files to create", plan.add),
+        ("Files to update", plan.update),
+        ("Files to delete", plan.delete),
+    ]:
+        logging.info(f"{label}:")
+        if len(paths) < 1:
+            logging.info("  (none)")
+        for f in paths:
+            logging.info(f"  - {str(f)}")
+    logging.info(f"Files unchanged: {len(plan.unchanged)}")
+    metrics.count("writes_skipped", len(plan.unchanged))
+    if not plan.has_changes():
+        return
 
-    files_to_delete = [fn for fn in current_filetree if fn not in new_filetree]
-    logging.info("Files to delete:")
-    if len(files_to_delete) < 1:
-        logging.info("  (none)")
-    for f in files_to_delete:
-        logging.info(f"  - {str(f)}")
+    with metrics.phase("writes"):
+        contents = {s.path: s.content for s in specs}
+        staged = []
+        written = 0
+        # Writes and deletions are counted as they happen, so that the
+        # metrics match the disk even if a later step fails.
+        try:
+            for path in plan.add + plan.update:
+                check_cancelled(cancel)
+                staged.append((stage_file(contents[path], path), path))
+            for temp_path, path in staged:
+                check_cancelled(cancel)
+                os.replace(temp_path, path)
+                written += 1
+                metrics.count("files_written")
+        finally:
+            for temp_path, _ in staged[written:]:
+                temp_path.unlink(missing_ok=True)
 
-    for content, path in specs:
-        write_file_sparingly(content, path, ignore_lines=0, no_compare=True)
+        for fn in plan.delete:
+            check_cancelled(cancel)
+            logging.info(f"Deleting file: {str(fn)}")
+            fn.unlink(missing_ok=True)
+            metrics.count("files_deleted")
 
-    for fn in files_to_delete:
-        logging.info(f"Deleting file: {str(fn)}")
-        fn.unlink(missing_ok=True)
+        sync_directory(root)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+icons.py: cached lookup of Distrobox container icons.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import logging
+from os import environ
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+
+from konsoledistroboxintegration.metrics import metrics
+
+# Preferred icon formats when a directory holds several icons with the
+# same stem; anything else sorts after these.
+ICON_SUFFIXES = [".svg", ".png"]
+
+
+def get_icon_dirs() -> List[Path]:
+    """
+    Returns the Distrobox icon directories, in lookup order: the user's
+    data directory (where `distrobox-generate-entry` saves icons) first,
+    then the system data directories, as per the XDG base directory
+    specification.
+
+    Returns:
+        List[Path]: the icon directories, existing or not.
+    """
+    data_home = environ.get("XDG_DATA_HOME") or str(Path.home() / ".local/share")
+    data_dirs = environ.get("XDG_DATA_DIRS") or "/usr/local/share:/usr/share"
+    return [
+        Path(d) / "icons/distrobox"
+        for d in [data_home, *data_dirs.split(":")]
+        if len(d) > 0
+    ]
+
+
+def get_icon_stem(image_path: str) -> str:
+    """
+    Returns the icon stem for a container image, i.e. the image name
+    without registry, repository or tag.
+
+    Args:
+        image_path (str): the full image name.
+
+    Returns:
+        str: the icon stem.
+    """
+    return image_path.split("/")[-1].split(":")[0]
+
+
+class IconIndex:
+    """
+    Index of icon stems to paths over the Distrobox icon directories.
+
+    The index is built on first use, and rebuilt by `refresh` only when
+    the modification time of one of the directories changes.
+    """
+
+    def __init__(self, dirs: Optional[List[Path]] = None) -> None:
+        """
+        Args:
+            dirs (Optional[List[Path]]): directories to index, in lookup
+                                         order; defaults to
+                                         `get_icon_dirs()`.
+        """
+        self.dirs = dirs if dirs is not None else get_icon_dirs()
+        self.identity: Optional[Tuple] = None
+        self.index: Dict[str, Path] = {}
+
+    def get_identity(self) -> Tuple:
+        """
+        Returns the modification times of the indexed directories, or None
+        for directories that don't exist.
+
+        Returns:
+            Tuple: the directory identity.
+        """
+        identity = []
+        for d in self.dirs:
+            try:
+                identity.append(d.stat().st_mtime_ns)
+            except OSError:
+                identity.append(None)
+        return tuple(identity)
+
+    def refresh(self) -> None:
+        """
+        Rebuild the index if any of the directories changed since the last
+        build.
+        """
+        with metrics.phase("icons"):
+            identity = self.get_identity()
+            if identity == self.identity:
+                return
+            index = {}
+            for d, mtime in zip(self.dirs, identity):
+                if mtime is None:
+                    continue
+                try:
+                    paths = [p for p in d.iterdir() if p.is_file()]
+                except OSError as e:
+                    logging.warning(f"Cannot read icon directory {str(d)}: {e}")
+                    continue
+                paths.sort(
+                    key=lambda p: (
+                        (
+                            ICON_SUFFIXES.index(p.suffix)
+                            if p.suffix in ICON_SUFFIXES
+                            else len(ICON_SUFFIXES)
+                        ),
+                        p.name,
+                    )
+                )
+                for p in paths:
+                    index.setdefault(p.stem, p)
+            self.index = index
+            self.identity = identity
+
+    def lookup(self, image_path: str) -> Optional[Path]:
+        """
+        Return the icon path for a container image, building the index
+        first if it was never built.
+
+        Args:
+            image_path (str): the full image name.
+
+        Returns:
+            Optional[Path]: the icon path, or None if there is none.
+        """
+        if self.identity is None:
+            self.refresh()
+        return self.index.get(get_icon_stem(image_path))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+inotify.py: minimal ctypes wrapper around Linux inotify.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import os
+import ctypes
+import struct
+from typing import Dict, List, NamedTuple, Optional
+from pathlib import Path
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Changes that leave a complete file (or a new directory) behind, or
+# remove one.
+IN_CHANGES = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyEvent(NamedTuple):
+    path: Path
+    mask: int
+
+
+class Inotify:
+    """
+    An inotify instance. The file descriptor is non-blocking, so it can be
+    registered with an event loop and drained with `read_events`.
+    """
+
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.watches: Dict[int, Path] = {}
+
+    def add_watch(self, path: Path, mask: int = IN_CHANGES) -> int:
+        """
+        Watch a directory (or file) for changes.
+
+        Args:
+            path (Path): the path to watch.
+            mask (int): the inotify event mask.
+
+        Returns:
+            int: the watch descriptor.
+        """
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        self.watches[wd] = path
+        return wd
+
+    def read_events(self) -> List[InotifyEvent]:
+        """
+        Read all pending events, without blocking.
+
+        Returns:
+            List[InotifyEvent]: the events, with full paths for events on
+                                directory entries.
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                root: Optional[Path] = self.watches.get(wd)
+                if root is None:
+                    continue
+                path = root / os.fsdecode(name) if len(name) > 0 else root
+                events.append(InotifyEvent(path, mask))
+
+    def close(self) -> None:
+        os.close(self.fd)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+ipc.py: per-user Unix socket for talking to a running watcher.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import asyncio
+import json
+import socket
+import logging
+from os import environ
+from typing import Any, Callable, Dict, List, Optional
+from pathlib import Path
+from concurrent.futures import Future
+
+from konsoledistroboxintegration.events import RescanRequest
+
+SOCKET_NAME = "konsole-distrobox-integration.sock"
+# Longest accepted request line, in bytes.
+MAX_REQUEST_SIZE = 64 * 1024
+# Seconds a client waits for a requested regeneration.
+REFRESH_TIMEOUT = 300.0
+
+
+def get_socket_path() -> Optional[Path]:
+    """
+    Returns the watcher's socket path, under `$XDG_RUNTIME_DIR`.
+
+    Returns:
+        Optional[Path]: the path, or None if `$XDG_RUNTIME_DIR` is unset.
+    """
+    runtime_dir = environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        return None
+    return Path(runtime_dir) / SOCKET_NAME
+
+
+def send_request(request: Dict[str, Any], timeout: float) -> Optional[dict]:
+    """
+    Send a request to a running watcher and wait for its reply.
+
+    Args:
+        request (Dict[str, Any]): the request, with a "command" key of
+                                  "refresh" or "status".
+        timeout (float): seconds to wait for the reply.
+
+    Returns:
+        Optional[dict]: the reply, or None if no watcher is listening.
+    """
+    path = get_socket_path()
+    if path is None:
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = client.recv(64 * 1024)
+            if len(chunk) == 0:
+                break
+            data += chunk
+    return json.loads(data)
+
+
+async def handle_request(
+    request: dict,
+    notify: Callable[[Any], None],
+    get_status: Callable[[], dict],
+) -> dict:
+    """
+    Serve a decoded request.
+
+    Args:
+        request (dict): the request.
+        notify (Callable[[Any], None]): queues an event for regeneration,
+                                        i.e. `RegenerationScheduler.notify`.
+        get_status (Callable[[], dict]): returns the watcher's status.
+
+    Returns:
+        dict: the reply, with an "ok" key.
+    """
+    command = request.get("command")
+    if command == "status":
+        return {"ok": True, "status": get_status()}
+    if command == "refresh":
+        logging.info("Refresh requested over IPC.")
+        reply: Future = Future()
+        notify(
+            RescanRequest(
+                "refresh requested", verify=bool(request.get("force")), reply=reply
+            )
+        )
+        return await asyncio.wait_for(asyncio.wrap_future(reply), REFRESH_TIMEOUT)
+    return {"ok": False, "error": f"unknown command: {command}"}
+
+
+def make_request_handler(
+    notify: Callable[[Any], None], get_status: Callable[[], dict]
+) -> Callable[[asyncio.StreamReader, asyncio.StreamWriter], Any]:
+    """
+    Returns a connection handler for `asyncio.start_unix_server`, reading
+    one JSON request line and writing one JSON reply line.
+
+    Args:
+        notify (Callable[[Any], None]): queues an event for regeneration.
+        get_status (Callable[[], dict]): returns the watcher's status.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = json.loads(await reader.readline())
+                if not isinstance(request, dict):
+                    raise ValueError()
+            except ValueError:
+                reply = {"ok": False, "error": "malformed request"}
+            else:
+                reply = await handle_request(request, notify, get_status)
+            writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError) as e:
+            logging.warning(f"IPC request failed: {e!r}")
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def start_server(
+    notify: Callable[[Any], None], get_status: Callable[[], dict]
+) -> Optional[asyncio.AbstractServer]:
+    """
+    Listen on the watcher socket. A stale socket file left by a watcher
+    that died is replaced; a live one means another watcher is running,
+    and IPC is left to it.
+
+    Args:
+        notify (Callable[[Any], None]): queues an event for regeneration.
+        get_status (Callable[[], dict]): returns the watcher's status.
+
+    Returns:
+        Optional[asyncio.AbstractServer]: the server, or None if not
+                                          listening.
+    """
+    path = get_socket_path()
+    if path is None:
+        logging.info("XDG_RUNTIME_DIR is not set, not listening for requests.")
+        return None
+    if path.exists():
+        try:
+            alive = await asyncio.to_thread(send_request, {"command": "status"}, 1.0)
+        except (OSError, ValueError):
+            alive = None
+        if alive is not None:
+            logging.warning(f"Another watcher is listening on {str(path)}.")
+            return None
+        path.unlink(missing_ok=True)
+    try:
+        server = await asyncio.start_unix_server(
+            make_request_handler(notify, get_status),
+            path=str(path),
+            limit=MAX_REQUEST_SIZE,
+        )
+    except OSError as e:
+        logging.warning(f"Cannot listen on {str(path)}: {e}")
+        return None
+    path.chmod(0o600)
+    logging.info(f"Listening for requests on {str(path)}.")
+    return server
+
+
+def stop_server(server: asyncio.AbstractServer) -> None:
+    """
+    Stop listening, and remove the socket file.
+
+    Args:
+        server (asyncio.AbstractServer): the server from `start_server`.
+    """
+    server.close()
+    path = get_socket_path()
+    if path is not None:
+        path.unlink(missing_ok=True)
+
+
+def complete_requests(events: List[Any], reply: dict) -> None:
+    """
+    Resolve the replies of the `RescanRequest`s in a handled batch.
+
+    Args:
+        events (List[Any]): the batch.
+        reply (dict): the reply.
+    """
+    for e in events:
+        if isinstance(e, RescanRequest) and e.reply is not None:
+            if not e.reply.done():
+                e.reply.set_result(reply)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+konsolerc.py: reading and caching Konsole's configuration file.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import re
+from os.path import expandvars
+from typing import Dict, Optional, Tuple
+from pathlib import Path
+
+from konsoledistroboxintegration.files import get_file_identity
+
+# `[$...]` option flags of a key, e.g. `[$e]` (expand) or `[$i]`
+# (immutable).
+INI_KEY_FLAGS = re.compile(r"\[\$([a-z]+)\]")
+# Option flags after a group header, e.g. `[Group][$i]`.
+INI_GROUP_FLAGS = re.compile(r"(?<=\])\[\$[a-z]+\]$")
+# Escape sequences in values, and what they stand for.
+INI_ESCAPES = re.compile(r"\\(.)")
+INI_ESCAPE_CHARS = {"s": " ", "t": "\t", "n": "\n", "r": "\r", "\\": "\\"}
+
+# Resolved default profiles, keyed on konsolerc path, alongside the file
+# identity they were read from. Lives for the whole process, so the
+# watcher only re-reads konsolerc when it changes.
+_default_profile_cache: Dict[Path, Tuple[Tuple[int, int, int], Optional[str]]] = {}
+
+
+def read_ini(path: Path) -> Dict[str, Dict[str, str]]:
+    """
+    Parse a KDE-style INI file into groups of keys and values. Keys
+    before the first group header are placed in the "" group, and later
+    duplicate keys override earlier ones.
+
+    As in KConfig, `[$...]` option flags are stripped from group headers
+    and keys (e.g. `Key[$i]` reads as `Key`), values of keys flagged
+    `$e` have environment variables expanded, and escape sequences in
+    values are decoded. Localised keys (e.g. `Key[de]`) keep their
+    locale suffix, so they don't override the plain key.
+
+    Args:
+        path (Path): the file to read.
+
+    Returns:
+        Dict[str, Dict[str, str]]: the values, by group and key.
+    """
+    groups: Dict[str, Dict[str, str]] = {"": {}}
+    group = groups[""]
+    with open(path, "r", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if len(line) < 1 or line.startswith("#"):
+                continue
+            if line.startswith("["):
+                header = INI_GROUP_FLAGS.sub("", line)
+                if header.endswith("]"):
+                    group = groups.setdefault(header[1:-1], {})
+                continue
+            key, sep, value = line.partition("=")
+            if len(sep) < 1:
+                continue
+            key = key.strip()
+            flags = "".join(INI_KEY_FLAGS.findall(key))
+            key = INI_KEY_FLAGS.sub("", key)
+            value = unescape_ini_value(value.strip())
+            if "e" in flags:
+                value = expandvars(value)
+            group[key] = value
+    return groups
+
+
+def unescape_ini_value(value: str) -> str:
+    """
+    Decode the escape sequences KConfig writes in values.
+
+    Args:
+        value (str): the raw value.
+
+    Returns:
+        str: the decoded value.
+    """
+    return INI_ESCAPES.sub(lambda m: INI_ESCAPE_CHARS.get(m[1], m[0]), value)
+
+
+def get_default_profile(rc_file: Path) -> Optional[str]:
+    """
+    Returns Konsole's default profile file name, as set in the
+    `[Desktop Entry]` group of konsolerc. The result is cached until the
+    file changes.
+
+    Args:
+        rc_file (Path): the konsolerc path.
+
+    Returns:
+        Optional[str]: the profile file name (e.g. "Main.profile"), or
+                       None if konsolerc or the key doesn't exist.
+    """
+    identity = get_file_identity(rc_file)
+    if identity is None:
+        _default_profile_cache.pop(rc_file, None)
+        return None
+    cached = _default_profile_cache.get(rc_file)
+    if cached is not None and cached[0] == identity:
+        return cached[1]
+    try:
+        profile = read_ini(rc_file).get("Desktop Entry", {}).get("DefaultProfile")
+    except OSError:
+        return None
+    if profile is not None and len(profile) < 1:
+        profile = None
+    _default_profile_cache[rc_file] = (identity, profile)
+    return profile
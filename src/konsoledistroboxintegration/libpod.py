@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+libpod.py: client for podman's libpod REST API on the user socket, for
+           listing containers and following events without spawning
+           processes.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import asyncio
+import json
+import socket
+import logging
+from os import environ
+from typing import Any, AsyncIterator, Dict, List, Optional
+from pathlib import Path
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlencode
+from threading import Event, Lock, Thread
+
+from konsoledistroboxintegration.commands import (
+    CANCEL_POLL_INTERVAL,
+    COMMAND_TIMEOUT,
+    check_cancelled,
+)
+from konsoledistroboxintegration.events import (
+    EventKind,
+    PodmanEvent,
+    parse_libpod_event,
+)
+
+# Versioned prefix of the libpod endpoints; newer podman releases keep
+# serving older API versions.
+API_PREFIX = "/v4.0.0/libpod"
+# Longest accepted event line, in bytes.
+MAX_EVENT_SIZE = 1024 * 1024
+
+
+class LibpodError(Exception):
+    """
+    Raised when the libpod API can't be reached or returns an error.
+    """
+
+
+def get_podman_socket_path() -> Optional[Path]:
+    """
+    Returns the rootless podman API socket path, under `$XDG_RUNTIME_DIR`.
+
+    Returns:
+        Optional[Path]: the path, or None if `$XDG_RUNTIME_DIR` is unset.
+    """
+    runtime_dir = environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        return None
+    return Path(runtime_dir) / "podman/podman.sock"
+
+
+def socket_exists() -> bool:
+    """
+    Returns:
+        bool: True if the podman API socket exists.
+    """
+    path = get_podman_socket_path()
+    return path is not None and path.is_socket()
+
+
+def make_url(endpoint: str, params: Dict[str, Any]) -> str:
+    """
+    Args:
+        endpoint (str): the endpoint, e.g. "/containers/json".
+        params (Dict[str, Any]): query parameters; dicts and lists are
+                                 JSON-encoded, as libpod expects for
+                                 filters.
+
+    Returns:
+        str: the request path.
+    """
+    query = {
+        k: json.dumps(v) if isinstance(v, (dict, list)) else str(v)
+        for k, v in params.items()
+    }
+    return f"{API_PREFIX}{endpoint}?{urlencode(query)}"
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, socket_path: Path, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class LibpodClient:
+    """
+    libpod API client, keeping one connection alive across requests.
+    Safe to use from any thread; requests are serialised.
+    """
+
+    def __init__(self, socket_path: Path, timeout: float = COMMAND_TIMEOUT) -> None:
+        """
+        Args:
+            socket_path (Path): the podman API socket.
+            timeout (float): seconds to wait for a reply.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.lock = Lock()
+        self.connection: Optional[UnixHTTPConnection] = None
+
+    def get(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        cancel: Optional[Event] = None,
+    ) -> Any:
+        """
+        Send a GET request and decode its JSON reply.
+
+        Args:
+            endpoint (str): the endpoint, e.g. "/containers/json".
+            params (Dict[str, Any]): query parameters, see `make_url`.
+            cancel (Optional[Event]): abandons the request, raising
+                                      `Cancelled`, when set.
+
+        Returns:
+            Any: the decoded reply. Raises LibpodError if the request
+                 fails.
+        """
+        url = make_url(endpoint, params)
+        check_cancelled(cancel)
+        with self.lock:
+            done = Event()
+            if cancel is not None:
+                Thread(
+                    target=self.abort_on_cancel, args=(cancel, done), daemon=True
+                ).start()
+            try:
+                while True:
+                    reused = self.connection is not None
+                    if self.connection is None:
+                        self.connection = UnixHTTPConnection(
+                            self.socket_path, self.timeout
+                        )
+                    try:
+                        self.connection.request("GET", url)
+                        response = self.connection.getresponse()
+                        body = response.read()
+                    except (OSError, HTTPException) as e:
+                        self.close()
+                        check_cancelled(cancel)
+                        # podman closes idle connections; retry once on a new one.
+                        if reused:
+                            continue
+                        raise LibpodError(f"{endpoint}: {e!r}") from e
+                    break
+            finally:
+                done.set()
+            if response.will_close:
+                self.close()
+        if response.status != 200:
+            raise LibpodError(
+                f"{endpoint}: HTTP {response.status}: "
+                f"{body.decode('utf-8', errors='replace').strip()}"
+            )
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise LibpodError(f"{endpoint}: {e}") from e
+
+    def abort_on_cancel(self, cancel: Event, done: Event) -> None:
+        """
+        Shut the connection down once `cancel` is set, unblocking a
+        request waiting on the socket, unless the request is `done` first.
+
+        Args:
+            cancel (Event): the cancellation event.
+            done (Event): set when the request is over.
+        """
+        while not done.is_set():
+            if cancel.wait(CANCEL_POLL_INTERVAL):
+                connection = self.connection
+                if not done.is_set() and connection is not None:
+                    if connection.sock is not None:
+                        try:
+                            connection.sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+                return
+
+    def list_containers(
+        self,
+        label: Optional[str],
+        all: bool = True,
+        cancel: Optional[Event] = None,
+    ) -> List[dict]:
+        """
+        List containers, as `podman ps --format json` does.
+
+        Args:
+            label (Optional[str]): a `key=value` label filter, or None.
+            all (bool): include stopped containers.
+            cancel (Optional[Event]): abandons the listing when set.
+
+        Returns:
+            List[dict]: the container entries.
+        """
+        params: Dict[str, Any] = {"all": "true" if all else "false"}
+        if label is not None:
+            params["filters"] = {"label": [label]}
+        entries = self.get("/containers/json", params, cancel)
+        if not isinstance(entries, list):
+            raise LibpodError("/containers/json: unexpected reply")
+        return entries
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+async def stream_events(
+    socket_path: Path, since: Optional[float] = None
+) -> AsyncIterator[PodmanEvent]:
+    """
+    Follow container events from the libpod `/events` endpoint, on a
+    connection of its own, until podman closes it.
+
+    Args:
+        socket_path (Path): the podman API socket.
+        since (Optional[float]): only report events from this Unix time
+                                 on; podman replays its event log from
+                                 the start if None.
+
+    Yields:
+        PodmanEvent: the events of the kinds in `EventKind`.
+    """
+    params: Dict[str, Any] = {
+        "stream": "true",
+        "filters": {
+            "type": ["container"],
+            "event": [k.value for k in EventKind],
+        },
+    }
+    if since is not None:
+        params["since"] = f"{since:.0f}"
+    reader, writer = await asyncio.open_unix_connection(
+        str(socket_path), limit=MAX_EVENT_SIZE
+    )
+    try:
+        writer.write(
+            f"GET {make_url('/events', params)} HTTP/1.1\r\n"
+            "Host: localhost\r\n\r\n".encode("ascii")
+        )
+        await writer.drain()
+        status = (await reader.readline()).split()
+        if len(status) < 2 or status[1] != b"200":
+            raise LibpodError(f"/events: unexpected status {b' '.join(status)!r}")
+        chunked = False
+        while (header := await reader.readline()).strip():
+            name, _, value = header.decode("latin-1").partition(":")
+            if name.strip().lower() == "transfer-encoding":
+                chunked = "chunked" in value.lower()
+        logging.info(f"Following podman events on {str(socket_path)}.")
+        buffer = b""
+        while True:
+            try:
+                if chunked:
+                    size = int((await reader.readline()).split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    data = (await reader.readexactly(size + 2))[:-2]
+                else:
+                    data = await reader.read(64 * 1024)
+                    if len(data) == 0:
+                        break
+            except (asyncio.IncompleteReadError, ValueError):
+                break
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                if (event := parse_libpod_event(line)) is not None:
+                    yield event
+    finally:
+        writer.close()
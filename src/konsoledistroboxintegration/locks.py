@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+locks.py: advisory lock files making regenerations single-flight across
+          processes.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import fcntl
+import logging
+from typing import IO, List, Optional
+from pathlib import Path
+from threading import Event
+from time import perf_counter, sleep
+
+from konsoledistroboxintegration.commands import (
+    CANCEL_POLL_INTERVAL,
+    Cancelled,
+    check_cancelled,
+)
+
+LOCK_NAME = ".konsole-distrobox-integration.lock"
+
+
+class RegenerationLock:
+    """
+    Exclusive `flock` locks on a set of lock files, one per target
+    directory, taken in a fixed order so that processes locking
+    overlapping sets can't deadlock.
+    """
+
+    def __init__(self, paths: List[Path]) -> None:
+        """
+        Args:
+            paths (List[Path]): the lock files.
+        """
+        self.paths = sorted(set(paths))
+        self.files: List[IO[str]] = []
+
+    def acquire(self, cancel: Optional[Event] = None) -> float:
+        """
+        Take every lock, waiting for other holders, and log the wait.
+
+        Args:
+            cancel (Optional[Event]): gives up waiting, raising
+                                      `Cancelled`, when set.
+
+        Returns:
+            float: the seconds spent waiting.
+        """
+        start = perf_counter()
+        contended = False
+        try:
+            for path in self.paths:
+                lock_file = open(path, "a+")
+                self.files.append(lock_file)
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if not contended:
+                            logging.info(
+                                f"Waiting for another regeneration ({str(path)})."
+                            )
+                        contended = True
+                        check_cancelled(cancel)
+                        sleep(CANCEL_POLL_INTERVAL)
+        except (OSError, Cancelled):
+            self.release()
+            raise
+        waited = perf_counter() - start
+        logging.info(f"Regeneration lock acquired after {waited * 1000:.1f} ms.")
+        return waited
+
+    def release(self) -> None:
+        """
+        Release every lock held.
+        """
+        for lock_file in self.files:
+            lock_file.close()
+        self.files = []
@@ -14,31 +14,76 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 __package__ = "konsoledistroboxintegration"
 
 import json
-from typing import List
+import hashlib
+from typing import Any, List, Optional, Tuple
 from pathlib import Path
 from datetime import datetime
+from importlib.metadata import version, PackageNotFoundError
 
 from konsoledistroboxintegration.files import write_file_sparingly
 from konsoledistroboxintegration.profiles import Profile
 
+MANIFEST_NAME = ".konsole-distrobox-integration.json"
+MANIFEST_VERSION = 2
+CURSOR_NAME = ".konsole-distrobox-integration.cursor.json"
 
-def make_manifest(manifest_path: Path, profiles: List[Profile]) -> None:
+
+def make_manifest(
+    manifest_path: Path,
+    profiles: List[Profile],
+    fingerprint: Optional[str] = None,
+    inputs: Optional[str] = None,
+) -> None:
     """
     Create a JSON manifest file of generated profiles.
 
     Args:
         manifest_path (Path): the path of the JSON file to write.
         profiles (List[Profile]): the list of profiles to write.
+        fingerprint (Optional[str]): the input fingerprint the profiles
+                                     were generated from, see
+                                     `make_fingerprint`.
+        inputs (Optional[str]): a fingerprint of the target's rendering
+                                inputs besides the profiles themselves;
+                                profile files rendered with the same
+                                inputs are known to be unchanged.
     """
-    data = json.dumps({p.get_root_name(): p.to_dict() for p in profiles}, indent=4)
+    data = json.dumps(
+        {
+            "version": MANIFEST_VERSION,
+            "fingerprint": fingerprint,
+            "inputs": inputs,
+            "profiles": {p.get_root_name(): p.to_dict() for p in profiles},
+        },
+        indent=4,
+    )
     write_file_sparingly(
         data,
-        manifest_path / ".konsole-distrobox-integration.json",
+        manifest_path / MANIFEST_NAME,
         ignore_lines=None,
         no_compare=False,
     )
 
 
+def read_manifest_data(manifest_path: Path) -> dict:
+    """
+    Read a JSON manifest file, upgrading manifests from before
+    `MANIFEST_VERSION` 2 (a bare mapping of profiles).
+
+    Args:
+        manifest_path (Path): the path of the JSON file to read.
+
+    Returns:
+        dict: the manifest data, with "fingerprint", "inputs" and
+              "profiles" keys.
+    """
+    with open(manifest_path / MANIFEST_NAME, "r") as manifest_file:
+        data = json.loads(manifest_file.read())
+    if data.get("version") != MANIFEST_VERSION:
+        return {"fingerprint": None, "inputs": None, "profiles": data}
+    return {"inputs": None, **data}
+
+
 def read_manifest(manifest_path: Path) -> List[Profile]:
     """
     Read a JSON manifest file and returns the profiles.
@@ -49,11 +94,119 @@ def read_manifest(manifest_path: Path) -> List[Profile]:
     Returns:
         List[Profile]: the list of profiles read.
     """
-    with open(
-        manifest_path / ".konsole-distrobox-integration.json", "r"
-    ) as manifest_file:
-        data = json.loads(manifest_file.read())
-        return [Profile.from_dict(v) for v in data.values()]
+    data = read_manifest_data(manifest_path)
+    return [Profile.from_dict(v) for v in data["profiles"].values()]
+
+
+def read_fingerprint(manifest_path: Path) -> Optional[str]:
+    """
+    Read the input fingerprint stored in a JSON manifest file.
+
+    Args:
+        manifest_path (Path): the path of the JSON file to read.
+
+    Returns:
+        Optional[str]: the fingerprint, or None if the manifest is
+                       missing, unreadable or has no fingerprint.
+    """
+    try:
+        return read_manifest_data(manifest_path).get("fingerprint")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def update_manifest(
+    manifest_path: Path,
+    updated: List[Profile],
+    removed: List[Profile],
+    fingerprint: Optional[str] = None,
+    inputs: Optional[str] = None,
+) -> None:
+    """
+    Apply a delta to an existing JSON manifest file. Raises if the
+    manifest is missing or unreadable, in which case the caller should
+    fall back to a full `make_manifest`.
+
+    Args:
+        manifest_path (Path): the path of the JSON file to update.
+        updated (List[Profile]): profiles to add or replace.
+        removed (List[Profile]): profiles to drop, matched by root name.
+        fingerprint (Optional[str]): the input fingerprint of the
+                                     resulting profiles; None clears
+                                     the stored one.
+        inputs (Optional[str]): the rendering inputs fingerprint, see
+                                `make_manifest`.
+    """
+    profiles = {p.get_root_name(): p for p in read_manifest(manifest_path)}
+    for p in removed:
+        profiles.pop(p.get_root_name(), None)
+    for p in updated:
+        profiles[p.get_root_name()] = p
+    make_manifest(manifest_path, list(profiles.values()), fingerprint, inputs)
+
+
+def write_cursor(manifest_path: Path, cursor: str, fingerprint: str) -> None:
+    """
+    Record the journal cursor of the last event reflected in the manifest,
+    next to it.
+
+    Args:
+        manifest_path (Path): the manifest's directory.
+        cursor (str): the journal cursor.
+        fingerprint (str): a fingerprint of the inputs besides the journal
+                           that the manifest was generated from.
+    """
+    data = json.dumps({"cursor": cursor, "fingerprint": fingerprint}, indent=4)
+    write_file_sparingly(
+        data, manifest_path / CURSOR_NAME, ignore_lines=None, no_compare=False
+    )
+
+
+def read_cursor(manifest_path: Path) -> Optional[Tuple[str, str]]:
+    """
+    Read the journal cursor stored by `write_cursor`.
+
+    Args:
+        manifest_path (Path): the manifest's directory.
+
+    Returns:
+        Optional[Tuple[str, str]]: the cursor and input fingerprint, or
+                                   None if missing or unreadable.
+    """
+    try:
+        with open(manifest_path / CURSOR_NAME, "r") as cursor_file:
+            data = json.loads(cursor_file.read())
+        return str(data["cursor"]), str(data["fingerprint"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def get_package_version() -> str:
+    """
+    Returns the installed version of this package.
+
+    Returns:
+        str: the version, or "unknown" if not installed.
+    """
+    try:
+        return version("konsole-distrobox-integration")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def make_fingerprint(*inputs: Any) -> str:
+    """
+    Returns a digest of JSON-serialisable generation inputs, for
+    detecting whether a previous run already produced the same output.
+
+    Args:
+        *inputs (Any): the inputs; non-JSON values are stringified.
+
+    Returns:
+        str: the hex digest.
+    """
+    data = json.dumps([get_package_version(), *inputs], default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
 
 
 def get_gen_comment() -> str:
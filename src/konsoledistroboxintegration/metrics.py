@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+metrics.py: per-phase counters and timings, and their export as a
+            Prometheus textfile or JSON stats file.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import json
+import logging
+from contextlib import contextmanager
+from collections import deque
+from math import ceil
+from typing import Deque, Dict, Iterator, Optional
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+
+# Timed phases, in the order they run in a cycle.
+PHASES = ["listing", "icons", "rendering", "writes", "hooks"]
+# Counters, with their Prometheus help text.
+COUNTERS = {
+    "files_written": "Profile files created or updated.",
+    "files_deleted": "Stray profile files deleted.",
+    "writes_skipped": "Profile files left alone because they were unchanged.",
+    "events_received": "Podman events read from the journal.",
+    "events_coalesced": "Events merged into another event's regeneration.",
+    "events_dropped": "Events dropped as unrelated to any profile.",
+    "relevance_hits": "Events whose container was in the relevance cache.",
+    "relevance_misses": "Events whose container was not in the relevance cache.",
+    "hooks_run": "Post-commit hook commands run.",
+}
+PROMETHEUS_PREFIX = "konsole_distrobox_integration"
+# Number of recent event-to-profile latencies kept for percentiles.
+LATENCY_WINDOW = 1024
+LATENCY_QUANTILES = [0.5, 0.95, 0.99]
+# Mode of the stats file; readable by collectors running as other users,
+# e.g. node_exporter's textfile collector.
+STATS_FILE_MODE = 0o644
+
+
+class LatencyWindow:
+    """
+    Rolling window of the most recent event-to-profile latencies, with
+    lifetime totals.
+    """
+
+    def __init__(self, size: int = LATENCY_WINDOW) -> None:
+        """
+        Args:
+            size (int): the number of samples kept.
+        """
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def get_quantiles(self) -> Dict[float, float]:
+        """
+        Returns:
+            Dict[float, float]: the nearest-rank value of each of
+                                `LATENCY_QUANTILES` over the window, or
+                                nothing if the window is empty.
+        """
+        ordered = sorted(self.samples)
+        if len(ordered) < 1:
+            return {}
+        return {
+            q: ordered[min(ceil(q * len(ordered)), len(ordered)) - 1]
+            for q in LATENCY_QUANTILES
+        }
+
+
+def format_cycle(cycle: Dict[str, float]) -> str:
+    """
+    Format a cycle's figures on one line.
+
+    Args:
+        cycle (Dict[str, float]): the figures, as returned by
+                                  `Metrics.end_cycle`.
+
+    Returns:
+        str: the summary.
+    """
+    return (
+        f"{cycle['duration_seconds'] * 1000:.1f} ms"
+        + "".join(f", {p} {cycle[f'{p}_seconds'] * 1000:.1f} ms" for p in PHASES)
+        + f"; {cycle['files_written']} written, {cycle['files_deleted']} "
+        f"deleted, {cycle['writes_skipped']} unchanged; "
+        f"{cycle['events_received']} event(s), "
+        f"{cycle['events_coalesced']} coalesced, "
+        f"{cycle['events_dropped']} dropped"
+    )
+
+
+class Metrics:
+    """
+    Counters and phase timings for the current regeneration cycle and
+    for the lifetime of the process. Safe to update from any thread.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.cycles = 0
+        self.totals: Dict[str, float] = self.make_empty()
+        self.cycle: Dict[str, float] = self.make_empty()
+        self.last_cycle: Optional[Dict[str, float]] = None
+        self.last_cycle_end: Optional[float] = None
+        self.cycle_start = perf_counter()
+        self.latency = LatencyWindow()
+
+    @staticmethod
+    def make_empty() -> Dict[str, float]:
+        return {
+            **{f"{p}_seconds": 0.0 for p in PHASES},
+            **{c: 0 for c in COUNTERS},
+        }
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        """
+        Increment a counter.
+
+        Args:
+            counter (str): a key of `COUNTERS`.
+            amount (int): the increment.
+        """
+        with self.lock:
+            self.cycle[counter] += amount
+            self.totals[counter] += amount
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """
+        Add time spent in a phase.
+
+        Args:
+            phase (str): one of `PHASES`.
+            seconds (float): the time.
+        """
+        with self.lock:
+            self.cycle[f"{phase}_seconds"] += seconds
+            self.totals[f"{phase}_seconds"] += seconds
+
+    def record_latency(self, seconds: float) -> None:
+        """
+        Record the time from an event to the end of the regeneration
+        that handled it.
+
+        Args:
+            seconds (float): the latency.
+        """
+        with self.lock:
+            self.latency.record(seconds)
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """
+        Time the enclosed block as part of a phase. Phases running
+        concurrently (e.g. several sources listing at once) add up.
+
+        Args:
+            phase (str): one of `PHASES`.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, perf_counter() - start)
+
+    def begin_cycle(self) -> None:
+        """
+        Start timing a regeneration cycle. Figures recorded since the
+        previous cycle ended, such as events received while waiting,
+        count towards this one.
+        """
+        with self.lock:
+            self.cycle_start = perf_counter()
+
+    def end_cycle(self) -> Dict[str, float]:
+        """
+        Finish a regeneration cycle, and log its one-line summary.
+
+        Returns:
+            Dict[str, float]: the cycle's figures, with its duration.
+        """
+        with self.lock:
+            cycle = self.cycle
+            cycle["duration_seconds"] = perf_counter() - self.cycle_start
+            self.cycle = self.make_empty()
+            self.cycles += 1
+            number = self.cycles
+            self.last_cycle = cycle
+            self.last_cycle_end = time()
+        logging.info(f"Cycle {number}: {format_cycle(cycle)}.")
+        return cycle
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "updated": time(),
+                "cycles": self.cycles,
+                "last_cycle_end": self.last_cycle_end,
+                "totals": dict(self.totals),
+                "latency": {
+                    "count": self.latency.count,
+                    "sum_seconds": self.latency.sum,
+                    **{
+                        f"p{round(q * 100)}_seconds": v
+                        for q, v in self.latency.get_quantiles().items()
+                    },
+                },
+                "last_cycle": (
+                    dict(self.last_cycle) if self.last_cycle is not None else None
+                ),
+            }
+
+    def to_prometheus(self) -> str:
+        """
+        Returns:
+            str: the metrics in the Prometheus text exposition format, for
+                 the node exporter's textfile collector.
+        """
+        data = self.to_dict()
+        totals = data["totals"]
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_phase_seconds_total Time spent in each phase.",
+            f"# TYPE {p}_phase_seconds_total counter",
+            *[
+                f'{p}_phase_seconds_total{{phase="{phase}"}} '
+                f"{totals[f'{phase}_seconds']}"
+                for phase in PHASES
+            ],
+        ]
+        for counter, help in COUNTERS.items():
+            lines += [
+                f"# HELP {p}_{counter}_total {help}",
+                f"# TYPE {p}_{counter}_total counter",
+                f"{p}_{counter}_total {totals[counter]}",
+            ]
+        latency = data["latency"]
+        lines += [
+            f"# HELP {p}_event_latency_seconds Time from a Podman event to "
+            "the end of its regeneration, over recent events.",
+            f"# TYPE {p}_event_latency_seconds summary",
+            *[
+                f'{p}_event_latency_seconds{{quantile="{q}"}} '
+                f"{latency[f'p{round(q * 100)}_seconds']}"
+                for q in LATENCY_QUANTILES
+                if f"p{round(q * 100)}_seconds" in latency
+            ],
+            f"{p}_event_latency_seconds_sum {latency['sum_seconds']}",
+            f"{p}_event_latency_seconds_count {latency['count']}",
+        ]
+        lines += [
+            f"# HELP {p}_cycles_total Regeneration cycles run.",
+            f"# TYPE {p}_cycles_total counter",
+            f"{p}_cycles_total {data['cycles']}",
+        ]
+        if data["last_cycle"] is not None:
+            lines += [
+                f"# HELP {p}_last_cycle_seconds Duration of the last cycle.",
+                f"# TYPE {p}_last_cycle_seconds gauge",
+                f"{p}_last_cycle_seconds {data['last_cycle']['duration_seconds']}",
+                f"# HELP {p}_last_cycle_timestamp_seconds End of the last cycle.",
+                f"# TYPE {p}_last_cycle_timestamp_seconds gauge",
+                f"{p}_last_cycle_timestamp_seconds {data['last_cycle_end']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def format_stats(self, path: Path) -> str:
+        """
+        Format the metrics for a stats file: in the Prometheus text format
+        if its name ends in `.prom`, else as JSON.
+
+        Args:
+            path (Path): the stats file.
+
+        Returns:
+            str: the file contents.
+        """
+        if path.suffix == ".prom":
+            return self.to_prometheus()
+        return json.dumps(self.to_dict(), indent=4) + "\n"
+
+
+# Process-wide metrics, updated by the instrumented phases.
+metrics = Metrics()
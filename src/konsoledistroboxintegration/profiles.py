@@ -13,17 +13,24 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
-from typing import Optional, Self
+from typing import Iterable, List, NamedTuple, Optional, Self, Tuple
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Profile:
     name: str
     source: str
     icon: Optional[Path]
     exec_command: str
+    # Stable identity of the profiled thing (e.g. a container ID), for
+    # telling renames apart from removals. Not part of equality, as it
+    # doesn't affect the rendered profile.
+    uid: Optional[str] = field(default=None, compare=False)
+    # A faster equivalent of `exec_command` for terminal profiles, e.g.
+    # the `podman exec` command `distrobox enter` would run.
+    fast_exec_command: Optional[str] = None
 
     def to_dict(self) -> dict[str, str]:
         """
@@ -32,18 +39,15 @@ class Profile:
         Returns:
             dict[str, str]: the dict representation.
         """
-        if self.icon is None:
-            return {
-                "name": self.name,
-                "source": self.source,
-                "exec": self.exec_command,
-            }
-        return {
-            "name": self.name,
-            "source": self.source,
-            "icon": str(self.icon),
-            "exec": self.exec_command,
-        }
+        data = {"name": self.name, "source": self.source}
+        if self.icon is not None:
+            data["icon"] = str(self.icon)
+        data["exec"] = self.exec_command
+        if self.uid is not None:
+            data["uid"] = self.uid
+        if self.fast_exec_command is not None:
+            data["fast_exec"] = self.fast_exec_command
+        return data
 
     def get_root_name(self) -> str:
         """
@@ -107,6 +111,78 @@ class Profile:
         return Profile(
             name=source["name"],
             source=source["source"],
-            icon=source["icon"] if "icon" in source else None,
+            icon=Path(source["icon"]) if "icon" in source else None,
             exec_command=source["exec"],
+            uid=source.get("uid"),
+            fast_exec_command=source.get("fast_exec"),
         )
+
+
+class ProfileDiff(NamedTuple):
+    """
+    The difference between two profile sets, matched by root name.
+    Profiles whose root name changed but whose `uid` didn't are renames.
+    """
+
+    added: List[Profile]
+    removed: List[Profile]
+    renamed: List[Tuple[Profile, Profile]]
+    changed: List[Profile]
+    unchanged: int
+
+    def has_changes(self) -> bool:
+        return any([self.added, self.removed, self.renamed, self.changed])
+
+    def get_updated(self) -> List[Profile]:
+        """
+        Returns:
+            List[Profile]: the new profiles that need rendering.
+        """
+        return [*self.added, *[new for _, new in self.renamed], *self.changed]
+
+    def get_removed(self) -> List[Profile]:
+        """
+        Returns:
+            List[Profile]: the old profiles that need removing.
+        """
+        return [*self.removed, *[old for old, _ in self.renamed]]
+
+
+def diff_profiles(old: Iterable[Profile], new: Iterable[Profile]) -> ProfileDiff:
+    """
+    Compare a previous profile set (e.g. from a manifest) with a new one.
+
+    Args:
+        old (Iterable[Profile]): the previous profiles.
+        new (Iterable[Profile]): the new profiles.
+
+    Returns:
+        ProfileDiff: the difference.
+    """
+    old_by_name = {p.get_root_name(): p for p in old}
+    new_by_name = {p.get_root_name(): p for p in new}
+    added, changed, unchanged = [], [], 0
+    for key, p in new_by_name.items():
+        previous = old_by_name.get(key)
+        if previous is None:
+            added.append(p)
+        elif previous != p:
+            changed.append(p)
+        else:
+            unchanged += 1
+    removed = [p for key, p in old_by_name.items() if key not in new_by_name]
+
+    removed_by_uid = {p.uid: p for p in removed if p.uid is not None}
+    renamed = []
+    for p in added:
+        if p.uid is not None and (previous := removed_by_uid.pop(p.uid, None)):
+            renamed.append((previous, p))
+    renamed_old = {id(old) for old, _ in renamed}
+    renamed_new = {id(new) for _, new in renamed}
+    return ProfileDiff(
+        added=[p for p in added if id(p) not in renamed_new],
+        removed=[p for p in removed if id(p) not in renamed_old],
+        renamed=renamed,
+        changed=changed,
+        unchanged=unchanged,
+    )
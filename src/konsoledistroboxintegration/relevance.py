@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+relevance.py: cache of which containers are Distrobox containers, for
+              dropping unrelated podman events in watch mode.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+from typing import Dict, Iterable, Optional
+from threading import Lock
+
+from konsoledistroboxintegration.events import EventKind, PodmanEvent
+from konsoledistroboxintegration.metrics import metrics
+from konsoledistroboxintegration.sources import DISTROBOX_LABEL, get_short_id
+
+
+class ContainerClassifier:
+    """
+    Cache from container ID to whether the container is a Distrobox
+    container, i.e. whether its events can change a profile.
+
+    It is filled from each full container listing, which holds every
+    Distrobox container that exists, and updated from create and remove
+    events. Once filled, an event for an unknown container that isn't
+    a creation must be for a container that existed at the listing
+    without being listed, so it is irrelevant too. Classifying never
+    runs a subprocess or touches the filesystem. Safe to use from any
+    thread.
+    """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.known: Dict[str, bool] = {}
+        self.filled = False
+
+    def fill(self, container_ids: Iterable[Optional[str]]) -> None:
+        """
+        Record the Distrobox containers of a full listing. Entries learned
+        from events are kept, as they may be newer than the listing.
+
+        Args:
+            container_ids (Iterable[Optional[str]]): the listed container
+                IDs. If any is unknown (None), the listing can't rule out
+                other containers, and the cache stays unfilled.
+        """
+        ids = list(container_ids)
+        with self.lock:
+            for container_id in ids:
+                if container_id is not None:
+                    self.known[get_short_id(container_id)] = True
+            self.filled = None not in ids
+
+    def classify(self, event: PodmanEvent) -> bool:
+        """
+        Decide whether an event is relevant, counting cache hits and
+        misses, and update the cache from create and remove events.
+
+        Args:
+            event (PodmanEvent): the event.
+
+        Returns:
+            bool: False if the event can be dropped.
+        """
+        key = get_short_id(event.container_id)
+        with self.lock:
+            relevant = self.known.get(key)
+            metrics.count("relevance_misses" if relevant is None else "relevance_hits")
+            if relevant is None:
+                if len(event.labels) > 0:
+                    relevant = (
+                        event.labels.get(DISTROBOX_LABEL[0]) == DISTROBOX_LABEL[1]
+                    )
+                else:
+                    relevant = event.kind == EventKind.CREATE or not self.filled
+            if event.kind == EventKind.CREATE:
+                self.known[key] = relevant
+            elif event.kind == EventKind.REMOVE:
+                self.known.pop(key, None)
+        if not relevant:
+            metrics.count("events_dropped")
+        return relevant
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+konsole-distrobox-integration
+
+scheduler.py: debouncing scheduler for coalescing watch events into
+              profile regenerations.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+__package__ = "konsoledistroboxintegration"
+
+import logging
+from typing import Any, Callable, List, Optional
+from threading import Condition, Event, Thread
+from time import monotonic
+
+from konsoledistroboxintegration.commands import Cancelled
+
+
+class RegenerationScheduler:
+    """
+    Collects events from a watcher and runs a callback once per burst.
+
+    A burst ends when no new events arrive for `quiet_window` seconds,
+    or when `max_delay` seconds have passed since its first event,
+    whichever comes first. The callback runs on a single worker thread,
+    so two regenerations never overlap; events arriving during a run
+    are collected into the next burst.
+
+    An event arriving during a run also sets the run's cancellation
+    event. A callback that stops early by raising `Cancelled` has its
+    batch put back in front of the newer events, and the merged burst
+    runs next. The retry itself is not cancelled, so a steady stream of
+    events can't starve regenerations.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[List[Any], Event], None],
+        quiet_window: float,
+        max_delay: float,
+    ) -> None:
+        """
+        Args:
+            callback (Callable[[List[Any], Event], None]): the
+                regeneration routine, called with the list of coalesced
+                events and the run's cancellation event.
+            quiet_window (float): seconds without events before a burst
+                                  is considered finished.
+            max_delay (float): upper bound, in seconds, between the
+                               first event of a burst and its run.
+        """
+        self.callback = callback
+        self.quiet_window = quiet_window
+        self.max_delay = max(max_delay, quiet_window)
+        self.condition = Condition()
+        self.pending: List[Any] = []
+        self.first_event: Optional[float] = None
+        self.last_event: Optional[float] = None
+        self.stopped = False
+        # Cancellation event of the running callback, if cancellable.
+        self.running: Optional[Event] = None
+        self.worker = Thread(
+            target=self._run, name="regeneration-scheduler", daemon=True
+        )
+
+    def start(self) -> None:
+        """
+        Start the worker thread.
+        """
+        self.worker.start()
+
+    def stop(self) -> None:
+        """
+        Stop the worker thread, cancelling any running regeneration and
+        waiting for it to return. Pending events are dropped.
+        """
+        with self.condition:
+            self.stopped = True
+            if self.running is not None:
+                self.running.set()
+            self.condition.notify()
+        if self.worker.is_alive():
+            self.worker.join()
+
+    def notify(self, event: Any = None) -> None:
+        """
+        Record a new event. Safe to call from any thread.
+
+        Args:
+            event (Any): the event object, passed on to the callback.
+        """
+        with self.condition:
+            now = monotonic()
+            if self.first_event is None:
+                self.first_event = now
+            self.last_event = now
+            self.pending.append(event)
+            if self.running is not None and not self.running.is_set():
+                logging.info("Newer events arrived, cancelling regeneration.")
+                self.running.set()
+            self.condition.notify()
+
+    def _next_deadline(self) -> Optional[float]:
+        """
+        Returns the monotonic time at which the pending burst is due,
+        or None if there is nothing pending. Must hold the condition.
+        """
+        if self.first_event is None:
+            return None
+        return min(
+            self.last_event + self.quiet_window,
+            self.first_event + self.max_delay,
+        )
+
+    def _take_batch(self) -> Optional[List[Any]]:
+        """
+        Wait until a burst is due, and return its events, or None
+        if the scheduler was stopped.
+        """
+        with self.condition:
+            while not self.stopped:
+                deadline = self._next_deadline()
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    batch = self.pending
+                    self.pending = []
+                    self.first_event = self.last_event = None
+                    return batch
+                self.condition.wait(remaining)
+            return None
+
+    def _requeue(self, batch: List[Any]) -> None:
+        """
+        Put a cancelled batch back in front of the pending events.
+        """
+        with self.condition:
+            now = monotonic()
+            self.pending = batch + self.pending
+            if self.first_event is None:
+                self.first_event = self.last_event = now
+            self.condition.notify()
+
+    def _run(self) -> None:
+        retrying = False
+        while (batch := self._take_batch()) is not None:
+            logging.info(f"Regenerating profiles for {len(batch)} event(s).")
+            cancel = Event()
+            with self.condition:
+                self.running = None if retrying else cancel
+            retrying = False
+            try:
+                self.callback(batch, cancel)
+            except Cancelled:
+                logging.info("Regeneration superseded, restarting with newer events.")
+                self._requeue(batch)
+                retrying = True
+            except Exception:
+                logging.exception("Profile regeneration failed.")
+            finally:
+                with self.condition:
+                    self.running = None
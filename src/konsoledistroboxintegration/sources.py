@@ -14,12 +14,50 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 __package__ = "konsoledistroboxintegration"
 
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from pathlib import Path
+from dataclasses import replace
+from os import environ
+from glob import glob
+from shlex import join as shlex_join, quote as shlex_quote, split as shlex_split
+from threading import Event, Lock
+from time import monotonic, perf_counter
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+import re
+import json
 import logging
 
 from konsoledistroboxintegration.profiles import Profile
-from konsoledistroboxintegration.commands import run_command, command_exists
+from konsoledistroboxintegration.commands import (
+    CANCEL_POLL_INTERVAL,
+    Cancelled,
+    CommandError,
+    command_exists,
+    run_command,
+)
+from konsoledistroboxintegration.icons import IconIndex
+from konsoledistroboxintegration.libpod import (
+    LibpodClient,
+    LibpodError,
+    get_podman_socket_path,
+    socket_exists,
+)
+from konsoledistroboxintegration.files import write_file_sparingly
+from konsoledistroboxintegration.metrics import metrics
+
+# Label distrobox sets on every container it creates.
+DISTROBOX_LABEL = ("manager", "distrobox")
+# Label toolbox sets on every container it creates.
+TOOLBOX_LABEL = ("com.github.containers.toolbox", "true")
+# Container IDs are compared by their short form, as `distrobox list`
+# prints them; podman and journal events give the full ID.
+SHORT_ID_LENGTH = 12
+# An ssh_config line: a keyword, then arguments after whitespace or "=".
+SSH_CONFIG_LINE = re.compile(r"^\s*(\w+)(?:\s*=\s*|\s+)(.*)$")
+
+
+def get_short_id(container_id: str) -> str:
+    return container_id[:SHORT_ID_LENGTH]
 
 
 class ProfileSource(ABC):
@@ -44,15 +82,29 @@ class ProfileSource(ABC):
         pass
 
     @abstractmethod
-    def get_profiles(self) -> List[Profile]:
+    def get_profiles(self, cancel: Optional[Event] = None) -> List[Profile]:
         """
         Get a list of profiles to generate.
 
+        Args:
+            cancel (Optional[Event]): abandons the listing, raising
+                                      `Cancelled`, when set.
+
         Returns:
             List[Profile]: the list of Profiles.
         """
         pass
 
+    def get_watch_paths(self) -> List[Path]:
+        """
+        Returns files whose changes should trigger a regeneration in
+        watch mode (e.g. configuration files).
+
+        Returns:
+            List[Path]: the paths; empty by default.
+        """
+        return []
+
     @abstractmethod
     def check_dependencies(self) -> bool:
         """
@@ -65,14 +117,38 @@ class ProfileSource(ABC):
         pass
 
 
+class Container(NamedTuple):
+    name: str
+    image: str
+    status: str
+    container_id: str
+
+
 class DistroboxProfileGenerator(ProfileSource):
     """
     Profile generator for Distrobox containers.
     See docstrings for `ProfileSource` for more information.
     """
 
-    def __init__(self, current_user: str) -> None:
+    def __init__(
+        self,
+        current_user: str,
+        icon_index: Optional[IconIndex] = None,
+        enter_cache: Optional["EnterCommandCache"] = None,
+    ) -> None:
+        """
+        Args:
+            current_user (str): username of the current user.
+            icon_index (Optional[IconIndex]): an icon index to reuse
+                                              across runs; a new one if
+                                              None.
+            enter_cache (Optional[EnterCommandCache]): resolves fast-enter
+                                                       commands; profiles
+                                                       have none if None.
+        """
         self.current_user = current_user
+        self.icon_index = icon_index if icon_index is not None else IconIndex()
+        self.enter_cache = enter_cache
 
     def get_source_name(self) -> str:
         return "distrobox"
@@ -90,57 +166,892 @@ class DistroboxProfileGenerator(ProfileSource):
             Optional[Path]: a valid icon path, or None if it
                             doesn't exist.
         """
-        image_path_base = image_path.split("/")[-1].split(":")[0]
+        return self.icon_index.lookup(image_path)
 
-        icons_folder = Path.home() / ".local/share/icons/distrobox"
-        if not icons_folder.is_dir():
-            return None
+    def make_profile(
+        self,
+        name: str,
+        image: Optional[str],
+        container_id: Optional[str] = None,
+    ) -> Profile:
+        """
+        Create a profile spec for a single Distrobox container.
+
+        Args:
+            name (str): the container name.
+            image (Optional[str]): the full image name, used for the
+                                   icon lookup; None for no icon.
+            container_id (Optional[str]): the container ID, if known; a
+                                          fast-enter command needs it.
+
+        Returns:
+            Profile: the profile spec, with a fast-enter command if one is
+                     cached, see `add_fast_enter`.
+        """
+        fast_exec_command = None
+        if self.enter_cache is not None and container_id is not None:
+            fast_exec_command = self.enter_cache.lookup(name, container_id)
+        return Profile(
+            name=name,
+            source=self.get_source_name(),
+            icon=self.get_icon(image) if image is not None else None,
+            exec_command=f"distrobox enter {name}",
+            uid=container_id,
+            fast_exec_command=fast_exec_command,
+        )
+
+    def add_fast_enter(
+        self,
+        profiles: List[Profile],
+        timeout: float,
+        cancel: Optional[Event] = None,
+    ) -> List[Profile]:
+        """
+        Resolve the fast-enter commands this source's profiles are
+        missing, see `EnterCommandCache.resolve_all`. Profiles whose
+        command can't be resolved in time keep using `distrobox enter`.
+
+        Args:
+            profiles (List[Profile]): the profiles, of any source.
+            timeout (float): seconds to wait for resolving.
+            cancel (Optional[Event]): abandons resolving, raising
+                                      `Cancelled`, when set.
+
+        Returns:
+            List[Profile]: the profiles, with the resolved commands.
+        """
+        if self.enter_cache is None:
+            return profiles
+        missing = {
+            (p.name, p.uid)
+            for p in profiles
+            if p.source == self.get_source_name()
+            and p.uid is not None
+            and p.fast_exec_command is None
+        }
+        if len(missing) < 1:
+            return profiles
+        if self.enter_cache.resolve_all(list(missing), timeout, cancel) < 1:
+            return profiles
+        return [
+            (
+                replace(p, fast_exec_command=self.enter_cache.lookup(p.name, p.uid))
+                if (p.name, p.uid) in missing
+                else p
+            )
+            for p in profiles
+        ]
 
-        for path in icons_folder.iterdir():
-            if path.stem == image_path_base:
-                return path
-        return None
+    def list_containers(self, cancel: Optional[Event] = None) -> List[Container]:
+        """
+        List Distrobox containers by parsing the `distrobox list` table.
+
+        Args:
+            cancel (Optional[Event]): abandons the listing when set.
 
-    def get_profiles(self) -> List[Profile]:
-        NAME, IMAGE = 1, 3
-        output = run_command(["distrobox", "list"]).splitlines()[1:]
+        Returns:
+            List[Container]: the containers.
+        """
+        ID, NAME, STATUS, IMAGE = 0, 1, 2, 3
+        output = run_command(["distrobox", "list"], cancel=cancel).splitlines()[1:]
         boxes = [[w.strip() for w in o.split("|")] for o in output]
+        return [
+            Container(
+                name=b[NAME], image=b[IMAGE], status=b[STATUS], container_id=b[ID]
+            )
+            for b in boxes
+            if len(b) > IMAGE
+        ]
+
+    def get_profiles(self, cancel: Optional[Event] = None) -> List[Profile]:
+        return self.make_profiles(self.list_containers(cancel))
+
+    def make_profiles(self, containers: List[Container]) -> List[Profile]:
+        """
+        Create profile specs for a container listing.
+
+        Args:
+            containers (List[Container]): the containers, as returned by
+                                          `list_containers`.
+
+        Returns:
+            List[Profile]: the list of Profiles.
+        """
+        self.icon_index.refresh()
         logging.info("distrobox: Generated profiles:")
-        for b in boxes:
-            logging.info(f"  - {b[NAME]}")
+        for c in containers:
+            logging.info(f"  - {c.name}")
+        profiles = [
+            self.make_profile(c.name, c.image, c.container_id) for c in containers
+        ]
+        if self.enter_cache is not None:
+            self.enter_cache.prune([c.container_id for c in containers])
+        return profiles
+
+    def check_dependencies(self) -> bool:
+        return all([command_exists("distrobox")])
+
+
+def list_podman_containers(
+    label: Optional[str], all: bool = True, cancel: Optional[Event] = None
+) -> List[dict]:
+    """
+    List podman containers with a single `podman ps` call.
+
+    Args:
+        label (Optional[str]): a `key=value` label filter, or None.
+        all (bool): include stopped containers.
+        cancel (Optional[Event]): abandons the listing when set.
+
+    Returns:
+        List[dict]: the decoded `podman ps --format json` entries. Raises
+                    ValueError if the output can't be decoded.
+    """
+    command = ["podman", "ps", "--format", "json"]
+    if all:
+        command.append("--all")
+    if label is not None:
+        command += ["--filter", f"label={label}"]
+    entries = json.loads(run_command(command, cancel=cancel))
+    if not isinstance(entries, list):
+        raise ValueError("podman ps: unexpected output")
+    return entries
+
+
+def get_podman_container(entry: dict) -> Container:
+    """
+    Read a Container from a `podman ps --format json` entry.
+
+    Args:
+        entry (dict): the entry.
+
+    Returns:
+        Container: the container.
+    """
+    return Container(
+        name=entry["Names"][0],
+        image=entry["Image"],
+        status=entry.get("State") or entry.get("Status", ""),
+        container_id=entry["Id"],
+    )
+
+
+class DistroboxPodmanProfileGenerator(DistroboxProfileGenerator):
+    """
+    Profile generator for Distrobox containers, listing them with a single
+    `podman ps` call instead of the `distrobox list` script. Falls back to
+    `DistroboxProfileGenerator.list_containers` if podman fails.
+    """
+
+    def list_containers(self, cancel: Optional[Event] = None) -> List[Container]:
+        try:
+            entries = list_podman_containers("=".join(DISTROBOX_LABEL), cancel=cancel)
+            return [get_podman_container(e) for e in entries]
+        except (CommandError, ValueError, KeyError, IndexError, TypeError) as e:
+            logging.warning(
+                f"distrobox: Cannot read podman listing ({e}), using `distrobox list`."
+            )
+            return super().list_containers(cancel)
+
+
+class DistroboxLibpodProfileGenerator(DistroboxPodmanProfileGenerator):
+    """
+    Profile generator for Distrobox containers, listing them through the
+    libpod REST API on the podman user socket, without spawning any
+    process. Falls back to `DistroboxPodmanProfileGenerator.list_containers`
+    if the API fails.
+    """
+
+    def __init__(
+        self,
+        current_user: str,
+        icon_index: Optional[IconIndex] = None,
+        enter_cache: Optional["EnterCommandCache"] = None,
+    ) -> None:
+        super().__init__(current_user, icon_index, enter_cache)
+        socket_path = get_podman_socket_path()
+        self.client = LibpodClient(socket_path) if socket_path is not None else None
+
+    def list_containers(self, cancel: Optional[Event] = None) -> List[Container]:
+        if self.client is not None:
+            try:
+                entries = self.client.list_containers(
+                    "=".join(DISTROBOX_LABEL), cancel=cancel
+                )
+                return [get_podman_container(e) for e in entries]
+            except (LibpodError, KeyError, IndexError, TypeError) as e:
+                logging.warning(
+                    f"distrobox: Cannot list containers over the podman socket "
+                    f"({e}), using `podman ps`."
+                )
+        return super().list_containers(cancel)
+
+
+def get_distrobox_source(
+    current_user: str,
+    backend: str,
+    icon_index: Optional[IconIndex] = None,
+    enter_cache: Optional["EnterCommandCache"] = None,
+) -> DistroboxProfileGenerator:
+    """
+    Returns the Distrobox profile source for a listing backend.
+
+    Args:
+        current_user (str): username of the current user.
+        backend (str): "libpod", "podman", "distrobox", or "auto"
+                       (libpod if the podman socket exists, else podman
+                       if available, else distrobox).
+        icon_index (Optional[IconIndex]): an icon index to reuse across
+                                          runs; a new one if None.
+        enter_cache (Optional[EnterCommandCache]): resolves fast-enter
+                                                   commands, if given.
+
+    Returns:
+        DistroboxProfileGenerator: the profile source.
+    """
+    if backend == "libpod" or (backend == "auto" and socket_exists()):
+        return DistroboxLibpodProfileGenerator(current_user, icon_index, enter_cache)
+    if backend == "podman" or (backend == "auto" and command_exists("podman")):
+        return DistroboxPodmanProfileGenerator(current_user, icon_index, enter_cache)
+    return DistroboxProfileGenerator(current_user, icon_index, enter_cache)
+
+
+class ToolboxProfileGenerator(ProfileSource):
+    """
+    Profile generator for Toolbx containers.
+    See docstrings for `ProfileSource` for more information.
+    """
+
+    def __init__(
+        self, current_user: str, icon_index: Optional[IconIndex] = None
+    ) -> None:
+        self.current_user = current_user
+        self.icon_index = icon_index if icon_index is not None else IconIndex()
+
+    def get_source_name(self) -> str:
+        return "toolbox"
+
+    def get_profiles(self, cancel: Optional[Event] = None) -> List[Profile]:
+        containers = [
+            get_podman_container(e)
+            for e in list_podman_containers("=".join(TOOLBOX_LABEL), cancel=cancel)
+        ]
         return [
             Profile(
-                name=b[NAME],
+                name=c.name,
                 source=self.get_source_name(),
-                icon=self.get_icon(b[IMAGE]),
-                exec_command=f"distrobox enter {b[NAME]}",
+                icon=self.icon_index.lookup(c.image),
+                exec_command=f"toolbox enter {c.name}",
+                uid=c.container_id,
             )
-            for b in boxes
+            for c in containers
         ]
 
     def check_dependencies(self) -> bool:
-        return all([command_exists("distrobox")])
+        return all([command_exists("toolbox"), command_exists("podman")])
+
+
+class PodmanProfileGenerator(ProfileSource):
+    """
+    Profile generator for running podman containers that aren't managed
+    by Distrobox or Toolbx, opening a shell with `podman exec`.
+    See docstrings for `ProfileSource` for more information.
+    """
+
+    def __init__(self, current_user: str) -> None:
+        self.current_user = current_user
+
+    def get_source_name(self) -> str:
+        return "podman"
+
+    def get_profiles(self, cancel: Optional[Event] = None) -> List[Profile]:
+        managed = [DISTROBOX_LABEL, TOOLBOX_LABEL]
+        containers = [
+            get_podman_container(e)
+            for e in list_podman_containers(label=None, all=False, cancel=cancel)
+            if not any(
+                (e.get("Labels") or {}).get(key) == value for key, value in managed
+            )
+        ]
+        return [
+            Profile(
+                name=c.name,
+                source=self.get_source_name(),
+                icon=None,
+                exec_command=f"podman exec --interactive --tty {c.name} /bin/sh",
+                uid=c.container_id,
+            )
+            for c in containers
+        ]
+
+    def check_dependencies(self) -> bool:
+        return all([command_exists("podman")])
 
 
-# class SSHProfileGenerator(ProfileSource):
-#     def __init__(self, current_user: str) -> None:
-#         self.current_user = current_user
-#         self.ssh_config_filepath = Path(f"/home/{current_user}/.ssh/config")
-
-#     def get_source_name(self) -> str:
-#         return "ssh"
-
-#     def get_profiles(self) -> List[Profile]:
-#         with open(self.ssh_config_filepath, "r") as ssh_config_file:
-#             hosts = [
-#                 line.strip().split(" ")[1]
-#                 for line in ssh_config_file.readlines()
-#                 if line.startswith("Host")
-#             ]
-#             return [
-#                 Profile(name=h, source="ssh", icon=None, exec_command=f"ssh {h}")
-#                 for h in hosts
-#             ]
-
-#     def check_dependencies(self) -> bool:
-#         return all([command_exists("ssh"), file_exists(self.ssh_config_filepath)])
+class SSHProfileGenerator(ProfileSource):
+    """
+    Profile generator for hosts in the user's OpenSSH client
+    configuration. `Include` directives are followed, and host patterns
+    with wildcards or negations are skipped, as they don't name a host.
+    See docstrings for `ProfileSource` for more information.
+    """
+
+    # OpenSSH's limit on nested Include directives.
+    MAX_INCLUDE_DEPTH = 16
+
+    def __init__(self, current_user: str) -> None:
+        self.current_user = current_user
+        self.ssh_dir = Path.home() / ".ssh"
+        self.ssh_config_filepath = self.ssh_dir / "config"
+
+    def get_source_name(self) -> str:
+        return "ssh"
+
+    def read_hosts(self, path: Path, depth: int = 0) -> List[str]:
+        """
+        Read host names from an ssh_config file and its includes.
+
+        Args:
+            path (Path): the config file.
+            depth (int): the current Include depth.
+
+        Returns:
+            List[str]: the host names, in order of appearance.
+        """
+        if depth > self.MAX_INCLUDE_DEPTH:
+            logging.warning(f"ssh: Include depth exceeded at {str(path)}.")
+            return []
+        hosts = []
+        with open(path, "r", errors="replace") as f:
+            for line in f:
+                match = SSH_CONFIG_LINE.match(line)
+                if match is None:
+                    continue
+                keyword = match.group(1).lower()
+                if keyword not in ("host", "include"):
+                    continue
+                try:
+                    args = shlex_split(match.group(2), comments=True)
+                except ValueError:
+                    continue
+                if keyword == "host":
+                    hosts += [a for a in args if not any(c in a for c in "*?!")]
+                    continue
+                for pattern in args:
+                    include_path = Path(pattern).expanduser()
+                    if not include_path.is_absolute():
+                        include_path = self.ssh_dir / include_path
+                    for include in sorted(glob(str(include_path))):
+                        hosts += self.read_hosts(Path(include), depth + 1)
+        return hosts
+
+    def get_profiles(self, cancel: Optional[Event] = None) -> List[Profile]:
+        hosts = list(dict.fromkeys(self.read_hosts(self.ssh_config_filepath)))
+        return [
+            Profile(
+                name=h,
+                source=self.get_source_name(),
+                icon=None,
+                exec_command=f"ssh {h}",
+            )
+            for h in hosts
+        ]
+
+    def get_watch_paths(self) -> List[Path]:
+        return [self.ssh_config_filepath]
+
+    def check_dependencies(self) -> bool:
+        return all([command_exists("ssh"), self.ssh_config_filepath.is_file()])
+
+
+def get_sources(
+    query: List[str],
+    current_user: str,
+    backend: str,
+    icon_index: Optional[IconIndex] = None,
+    fast_enter: bool = False,
+) -> List[ProfileSource]:
+    """
+    Returns source objects that match a query.
+
+    Args:
+        query (List[str]): source names, or ["all"].
+        current_user (str): username of the current user.
+        backend (str): the Distrobox listing backend, see
+                       `get_distrobox_source`.
+        icon_index (Optional[IconIndex]): an icon index shared by the
+                                          container sources.
+        fast_enter (bool): give Distrobox profiles fast-enter commands,
+                           see `EnterCommandCache`.
+
+    Returns:
+        List[ProfileSource]: the sources.
+    """
+    if icon_index is None:
+        icon_index = IconIndex()
+    all_sources = [
+        get_distrobox_source(
+            current_user,
+            backend,
+            icon_index,
+            EnterCommandCache() if fast_enter else None,
+        ),
+        ToolboxProfileGenerator(current_user, icon_index),
+        PodmanProfileGenerator(current_user),
+        SSHProfileGenerator(current_user),
+    ]
+    if "all" in query:
+        return all_sources
+    return [s for s in all_sources if s.get_source_name() in query]
+
+
+class SourceCache:
+    """
+    Last-good profiles of each source, kept in memory and in the user's
+    cache directory, for use when a source fails or misses its deadline.
+    """
+
+    def __init__(self) -> None:
+        cache_home = environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+        self.path = Path(cache_home) / "konsole-distrobox-integration/sources.json"
+        self.profiles: Optional[Dict[str, List[Profile]]] = None
+
+    def load(self) -> Dict[str, List[Profile]]:
+        """
+        Returns:
+            Dict[str, List[Profile]]: cached profiles by source name.
+        """
+        if self.profiles is None:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.loads(f.read())
+                self.profiles = {
+                    k: [Profile.from_dict(p) for p in v] for k, v in data.items()
+                }
+            except (OSError, ValueError, KeyError, AttributeError):
+                self.profiles = {}
+        return self.profiles
+
+    def store(self, results: Dict[str, List[Profile]]) -> None:
+        """
+        Record fresh results for some sources.
+
+        Args:
+            results (Dict[str, List[Profile]]): profiles by source name.
+        """
+        profiles = self.load()
+        if all(profiles.get(k) == v for k, v in results.items()):
+            return
+        profiles.update(results)
+        data = json.dumps(
+            {k: [p.to_dict() for p in v] for k, v in profiles.items()}, indent=4
+        )
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_file_sparingly(data, self.path, ignore_lines=None, no_compare=False)
+        except OSError as e:
+            logging.warning(f"Cannot write source cache: {e}")
+
+
+class EnterCommandCache:
+    """
+    Fast-enter commands of Distrobox containers, kept in memory and in
+    the user's cache directory, keyed on container ID so that a recreated
+    container gets a new one.
+
+    A fast-enter command runs the exec command line printed by `distrobox
+    enter --dry-run` directly, skipping the `distrobox enter` script, as
+    long as the container is running; otherwise it falls back to
+    `distrobox enter`, which starts it. Environment variables the dry-run
+    copied from the host are passed by name instead, along with
+    `SESSION_ENV`, so that each terminal passes its own values, and the
+    working directory is the terminal's own (`$PWD`). Safe to use from
+    any thread.
+    """
+
+    # Version of the cache file format; files of other versions are
+    # discarded.
+    VERSION = 3
+    # Dry-runs resolved at once.
+    MAX_WORKERS = 8
+    # Host session variables always passed to the container by name, even
+    # if unset when the command was resolved (e.g. from a service).
+    SESSION_ENV = [
+        "DISPLAY",
+        "WAYLAND_DISPLAY",
+        "XAUTHORITY",
+        "XDG_RUNTIME_DIR",
+        "XDG_SESSION_TYPE",
+        "XDG_CURRENT_DESKTOP",
+        "DBUS_SESSION_BUS_ADDRESS",
+        "SSH_AUTH_SOCK",
+        "TERM",
+        "COLORTERM",
+        "COLORFGBG",
+        "WINDOWID",
+        "SHELL_SESSION_ID",
+        "KONSOLE_VERSION",
+        "KONSOLE_DBUS_SERVICE",
+        "KONSOLE_DBUS_SESSION",
+        "KONSOLE_DBUS_WINDOW",
+        "PROFILEHOME",
+    ]
+
+    def __init__(self) -> None:
+        cache_home = environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+        self.path = Path(cache_home) / "konsole-distrobox-integration/enter.json"
+        self.lock = Lock()
+        self.commands: Optional[Dict[str, Dict[str, str]]] = None
+
+    def load(self) -> Dict[str, Dict[str, str]]:
+        """
+        Returns:
+            Dict[str, Dict[str, str]]: cached container names and
+                                       commands, by container ID.
+        """
+        if self.commands is None:
+            try:
+                with open(self.path, "r") as f:
+                    data = json.loads(f.read())
+                if data.get("version") != self.VERSION:
+                    raise ValueError("outdated cache")
+                self.commands = {
+                    str(k): {"name": str(v["name"]), "command": str(v["command"])}
+                    for k, v in data["commands"].items()
+                }
+            except (OSError, ValueError, KeyError, AttributeError, TypeError):
+                self.commands = {}
+        return self.commands
+
+    def save(self) -> None:
+        data = json.dumps({"version": self.VERSION, "commands": self.load()}, indent=4)
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_file_sparingly(data, self.path, ignore_lines=None, no_compare=False)
+        except OSError as e:
+            logging.warning(f"Cannot write fast-enter cache: {e}")
+
+    def lookup(self, name: str, container_id: str) -> Optional[str]:
+        """
+        Returns a container's cached fast-enter command, without resolving
+        it.
+
+        Args:
+            name (str): the container name.
+            container_id (str): the container ID.
+
+        Returns:
+            Optional[str]: the command, or None if not cached.
+        """
+        with self.lock:
+            cached = self.load().get(get_short_id(container_id))
+        if cached is None or cached["name"] != name:
+            return None
+        return cached["command"]
+
+    def resolve_all(
+        self,
+        containers: List[Tuple[str, str]],
+        timeout: float,
+        cancel: Optional[Event] = None,
+    ) -> int:
+        """
+        Resolve the fast-enter commands of containers missing from the
+        cache, in parallel. Dry-runs still running after `timeout` are
+        killed, and their containers are left for a later call.
+
+        Args:
+            containers (List[Tuple[str, str]]): container names and IDs.
+            timeout (float): seconds to wait for all dry-runs.
+            cancel (Optional[Event]): abandons resolving, raising
+                                      `Cancelled`, when set.
+
+        Returns:
+            int: the number of commands resolved.
+        """
+        todo = list({(n, i) for n, i in containers if self.lookup(n, i) is None})
+        if len(todo) < 1:
+            return 0
+        # Set once resolving is over, to kill stragglers' dry-runs.
+        stop = Event()
+        executor = ThreadPoolExecutor(
+            max_workers=min(len(todo), self.MAX_WORKERS),
+            thread_name_prefix="fast-enter",
+        )
+        futures = {executor.submit(self.resolve, n, i, stop): (n, i) for n, i in todo}
+        deadline = monotonic() + timeout
+        pending = set(futures)
+        while len(pending) > 0 and monotonic() < deadline:
+            remaining = deadline - monotonic()
+            if cancel is not None:
+                remaining = min(remaining, CANCEL_POLL_INTERVAL)
+            _, pending = wait_futures(pending, timeout=remaining)
+            if cancel is not None and cancel.is_set():
+                stop.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise Cancelled()
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if len(pending) > 0:
+            logging.warning(
+                f"distrobox: {len(pending)} fast-enter command(s) not resolved "
+                f"after {timeout:.1f} s, using `distrobox enter` for now."
+            )
+        resolved = {}
+        for future, (name, container_id) in futures.items():
+            if future in pending or future.cancelled() or future.exception():
+                continue
+            if (command := future.result()) is not None:
+                resolved[get_short_id(container_id)] = {
+                    "name": name,
+                    "command": command,
+                }
+        if len(resolved) > 0:
+            with self.lock:
+                self.load().update(resolved)
+                self.save()
+        return len(resolved)
+
+    def resolve(
+        self, name: str, container_id: str, cancel: Optional[Event] = None
+    ) -> Optional[str]:
+        """
+        Build a container's fast-enter command from `distrobox enter
+        --dry-run`, run from the home directory as a new terminal would.
+
+        Args:
+            name (str): the container name.
+            container_id (str): the container ID.
+            cancel (Optional[Event]): abandons resolving when set.
+
+        Returns:
+            Optional[str]: the command, or None if it can't be resolved.
+        """
+        try:
+            output = run_command(
+                ["distrobox", "enter", "--dry-run", name],
+                cancel=cancel,
+                cwd=Path.home(),
+            )
+        except CommandError as e:
+            logging.warning(f"distrobox: Cannot resolve fast-enter for {name}: {e}")
+            return None
+        # Anything besides a single exec command line (e.g. setup commands
+        # that must run first) can't be skipped safely.
+        lines = [line for line in output.splitlines() if line.strip() != ""]
+        command = None
+        if len(lines) == 1 and " exec " in lines[0]:
+            command = self.make_command(name, container_id, lines[0])
+        if command is None:
+            logging.warning(f"distrobox: Unexpected dry-run output for {name}.")
+        return command
+
+    def make_command(self, name: str, container_id: str, line: str) -> Optional[str]:
+        """
+        Build a fast-enter command from a dry-run exec command line. The
+        dry-run ran from the home directory, so the working directory it
+        resolved is replaced with the terminal's `$PWD` at launch.
+
+        Args:
+            name (str): the container name.
+            container_id (str): the container ID.
+            line (str): the exec command line, starting with the
+                        container manager Distrobox uses.
+
+        Returns:
+            Optional[str]: the command, or None if the line can't be
+                           parsed.
+        """
+        try:
+            argv = shlex_split(line)
+        except ValueError:
+            return None
+        if "exec" not in argv:
+            return None
+        manager = argv[: argv.index("exec")]
+        rest = argv[argv.index("exec") + 1 :]
+        options, passed, workdir = [], set(), None
+        while len(rest) > 0 and rest[0].startswith("-"):
+            option = rest.pop(0)
+            if option in ("--workdir", "-w") and len(rest) > 0:
+                workdir = self.get_workdir(rest.pop(0))
+                continue
+            elif option.startswith("--workdir="):
+                workdir = self.get_workdir(option.removeprefix("--workdir="))
+                continue
+            elif option in ("--env", "-e") and len(rest) > 0:
+                value = rest.pop(0)
+            elif option.startswith("--env="):
+                value = option.removeprefix("--env=")
+            else:
+                options.append(option)
+                continue
+            var, _, host_value = value.partition("=")
+            if var in self.SESSION_ENV or environ.get(var) == host_value:
+                # Copied from the resolving process; pass the terminal's.
+                passed.add(var)
+                options += ["--env", var]
+            else:
+                options += ["--env", value]
+        session = [
+            arg
+            for var in self.SESSION_ENV
+            if var not in passed
+            for arg in ["--env", var]
+        ]
+        running = shlex_join(
+            manager
+            + [
+                "inspect",
+                "--type",
+                "container",
+                "--format",
+                "{{.State.Running}}",
+                container_id,
+            ]
+        )
+        exec_command = shlex_join(manager + ["exec"] + session + options)
+        if workdir is not None:
+            exec_command += f" --workdir={workdir}"
+        script = (
+            f'[ "$({running} 2>/dev/null)" = true ] '
+            f"&& exec {exec_command} {shlex_join(rest)} "
+            f"|| exec distrobox enter {shlex_quote(name)}"
+        )
+        return shlex_join(["/bin/sh", "-c", script])
+
+    def get_workdir(self, resolved: str) -> str:
+        """
+        Returns the shell word for a fast-enter command's working
+        directory, in place of the one a dry-run resolved from the home
+        directory.
+
+        Args:
+            resolved (str): the resolved working directory.
+
+        Returns:
+            str: `"$PWD"`, under any prefix Distrobox added to the home
+                 directory (e.g. `/run/host` for a custom container home);
+                 the resolved directory, quoted, if it doesn't end with
+                 the home directory.
+        """
+        home = str(Path.home())
+        if not resolved.endswith(home):
+            return shlex_quote(resolved)
+        prefix = resolved.removesuffix(home)
+        return (shlex_quote(prefix) if prefix != "" else "") + '"$PWD"'
+
+    def prune(self, container_ids: List[str]) -> None:
+        """
+        Forget the commands of containers missing from a full listing.
+
+        Args:
+            container_ids (List[str]): the listed container IDs.
+        """
+        keep = {get_short_id(i) for i in container_ids}
+        with self.lock:
+            commands = self.load()
+            stale = [k for k in commands if k not in keep]
+            if len(stale) < 1:
+                return
+            for k in stale:
+                del commands[k]
+            self.save()
+
+
+def add_fast_enter_commands(
+    sources: List[ProfileSource],
+    profiles: List[Profile],
+    timeout: float,
+    cancel: Optional[Event] = None,
+) -> List[Profile]:
+    """
+    Resolve missing fast-enter commands of collected profiles, outside of
+    the listing deadline, see `DistroboxProfileGenerator.add_fast_enter`.
+
+    Args:
+        sources (List[ProfileSource]): the sources.
+        profiles (List[Profile]): the collected profiles.
+        timeout (float): seconds to wait for resolving.
+        cancel (Optional[Event]): abandons resolving, raising
+                                  `Cancelled`, when set.
+
+    Returns:
+        List[Profile]: the profiles, with the resolved commands.
+    """
+    for s in sources:
+        if isinstance(s, DistroboxProfileGenerator):
+            profiles = s.add_fast_enter(profiles, timeout, cancel)
+    return profiles
+
+
+def collect_profiles(
+    sources: List[ProfileSource],
+    timeout: float,
+    cache: SourceCache,
+    cancel: Optional[Event] = None,
+) -> Optional[List[Profile]]:
+    """
+    Collects profiles from several sources in parallel. A source that
+    fails or takes longer than `timeout` is replaced by its last-good
+    cached result, and its running commands are killed.
+
+    Args:
+        sources (List[ProfileSource]): the sources.
+        timeout (float): seconds to wait for each source, from the start
+                         of the collection.
+        cache (SourceCache): the last-good results.
+        cancel (Optional[Event]): abandons the collection, raising
+                                  `Cancelled`, when set.
+
+    Returns:
+        Optional[List[Profile]]: the profiles of all sources, or None if
+                                 a source failed without a cached result.
+    """
+    results: Dict[str, List[Profile]] = {}
+    fallbacks: List[str] = []
+    # Set once the collection is over, to kill stragglers' commands.
+    stop = Event()
+    listing_start = perf_counter()
+    executor = ThreadPoolExecutor(
+        max_workers=max(len(sources), 1), thread_name_prefix="profile-source"
+    )
+    futures = [(s, executor.submit(s.get_profiles, stop)) for s in sources]
+    deadline = monotonic() + timeout
+    pending = {f for _, f in futures}
+    while len(pending) > 0 and monotonic() < deadline:
+        remaining = deadline - monotonic()
+        if cancel is not None:
+            remaining = min(remaining, CANCEL_POLL_INTERVAL)
+        _, pending = wait_futures(pending, timeout=remaining)
+        if cancel is not None and cancel.is_set():
+            stop.set()
+            executor.shutdown(wait=False)
+            raise Cancelled()
+    stop.set()
+    executor.shutdown(wait=False)
+    metrics.add_time("listing", perf_counter() - listing_start)
+    for s, future in futures:
+        name = s.get_source_name()
+        if not future.done():
+            logging.warning(f"{name}: timed out after {timeout:.1f} s.")
+            fallbacks.append(name)
+            continue
+        try:
+            results[name] = future.result()
+        except Cancelled:
+            logging.warning(f"{name}: timed out after {timeout:.1f} s.")
+            fallbacks.append(name)
+        except Exception as e:
+            logging.warning(f"{name}: failed ({e}).")
+            fallbacks.append(name)
+
+    cache.store(results)
+    cached = cache.load()
+    for name in fallbacks:
+        if name not in cached:
+            logging.error(f"{name}: no cached profiles to fall back to.")
+            return None
+        logging.warning(f"{name}: using cached profiles.")
+        results[name] = cached[name]
+    return [p for s in sources for p in results[s.get_source_name()]]
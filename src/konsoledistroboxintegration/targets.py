@@ -13,18 +13,35 @@ file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 __package__ = "konsoledistroboxintegration"
 
+import logging
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Tuple
 from pathlib import Path
+from threading import Event
 
-from konsoledistroboxintegration.profiles import Profile
+from konsoledistroboxintegration.profiles import Profile, ProfileDiff, diff_profiles
 from konsoledistroboxintegration.files import (
     directory_exists,
     merge_file_tree,
+    apply_merge_plan,
+    get_file_identity,
     FileSpec,
+    MergePlan,
 )
-from konsoledistroboxintegration.commands import command_exists
-from konsoledistroboxintegration.manifests import make_manifest
+from konsoledistroboxintegration.commands import check_cancelled, command_exists
+from konsoledistroboxintegration.manifests import (
+    make_fingerprint,
+    make_manifest,
+    read_cursor,
+    read_fingerprint,
+    read_manifest,
+    read_manifest_data,
+    update_manifest,
+    write_cursor,
+)
+from konsoledistroboxintegration.locks import LOCK_NAME
+from konsoledistroboxintegration.konsolerc import get_default_profile
+from konsoledistroboxintegration.metrics import metrics
 
 
 class ProfileTarget(ABC):
@@ -49,12 +66,138 @@ class ProfileTarget(ABC):
         pass
 
     @abstractmethod
-    def make_targets(self, profiles: List[Profile]) -> None:
+    def make_targets(
+        self,
+        profiles: List[Profile],
+        fingerprint: Optional[str] = None,
+        verify: bool = False,
+        cancel: Optional[Event] = None,
+    ) -> MergePlan:
         """
         Process a list of profiles into files or entries.
 
+        Args:
+            profiles (List[Profile]): the list of Profiles.
+            fingerprint (Optional[str]): the input fingerprint, stored
+                                         for `get_fingerprint`.
+            verify (bool): check every entry against the target's actual
+                           state, instead of only writing the profiles
+                           that changed since the last recorded write.
+            cancel (Optional[Event]): stops writing, raising `Cancelled`,
+                                      when set. The target is left in a
+                                      state the next call fully repairs.
+
         Returns:
-            List[Profile]: the list of Profiles.
+            MergePlan: the changes made to the target's files.
+        """
+        pass
+
+    @abstractmethod
+    def get_fingerprint(self) -> Optional[str]:
+        """
+        Returns the input fingerprint stored by the last `make_targets`.
+
+        Returns:
+            Optional[str]: the fingerprint, or None if unknown.
+        """
+        pass
+
+    def get_input_identity(self) -> Any:
+        """
+        Returns a JSON-serialisable identity of target-specific inputs
+        (e.g. configuration files), for inclusion in the fingerprint.
+
+        Returns:
+            Any: the identity; None if the target has no such inputs.
+        """
+        return None
+
+    def get_watch_paths(self) -> List[Path]:
+        """
+        Returns files whose changes should trigger a regeneration in
+        watch mode (e.g. configuration files).
+
+        Returns:
+            List[Path]: the paths; empty by default.
+        """
+        return []
+
+    def get_lock_path(self) -> Optional[Path]:
+        """
+        Returns the lock file guarding the target's entries against
+        concurrent regenerations, see `RegenerationLock`.
+
+        Returns:
+            Optional[Path]: the lock file, or None if not needed.
+        """
+        return None
+
+    def get_post_commit_hooks(self) -> List[List[str]]:
+        """
+        Returns commands to run after a regeneration that changed the
+        target's entries (e.g. cache refreshes). Each distinct command
+        runs at most once per regeneration, however many targets ask
+        for it.
+
+        Returns:
+            List[List[str]]: the commands; none by default.
+        """
+        return []
+
+    def get_profiles(self) -> Optional[List[Profile]]:
+        """
+        Returns the profiles the target currently holds, as recorded by
+        the last write.
+
+        Returns:
+            Optional[List[Profile]]: the profiles, or None if unknown.
+        """
+        return None
+
+    def get_cursor(self) -> Optional[Tuple[str, str]]:
+        """
+        Returns the journal cursor stored by `save_cursor`.
+
+        Returns:
+            Optional[Tuple[str, str]]: the cursor and input fingerprint, or
+                                       None if unknown.
+        """
+        return None
+
+    def save_cursor(self, cursor: str, fingerprint: str) -> None:
+        """
+        Record the journal cursor of the last event reflected in the
+        target, for resuming watch mode. Does nothing by default.
+
+        Args:
+            cursor (str): the journal cursor.
+            fingerprint (str): a fingerprint of the other inputs.
+        """
+        pass
+
+    @abstractmethod
+    def apply_delta(
+        self,
+        updated: List[Profile],
+        removed: List[Profile],
+        fingerprint: Optional[str] = None,
+        cancel: Optional[Event] = None,
+    ) -> MergePlan:
+        """
+        Add or update entries for the given profiles, and remove entries
+        for others, leaving all remaining entries untouched. Raises if the
+        target's existing state cannot be read, in which case the caller
+        should fall back to `make_targets`.
+
+        Args:
+            updated (List[Profile]): the profiles to add or update.
+            removed (List[Profile]): the profiles to remove.
+            fingerprint (Optional[str]): the input fingerprint of the
+                                         resulting profile set, if known.
+            cancel (Optional[Event]): stops writing, see `make_targets`.
+
+        Returns:
+            MergePlan: the changes made to the target's files.
         """
         pass
 
@@ -70,10 +213,256 @@ class ProfileTarget(ABC):
         pass
 
 
-class KonsoleTarget(ProfileTarget):
-    def __init__(self, current_user: str) -> None:
+class FileTarget(ProfileTarget):
+    """
+    Base class for targets that write one file per profile into a
+    directory, alongside a manifest. Subclasses provide the file
+    contents through `make_config_file`.
+    """
+
+    def __init__(self, current_user: str, profiles_dir: Path, suffix: str) -> None:
+        """
+        Args:
+            current_user (str): username of the current user.
+            profiles_dir (Path): the directory to write files into.
+            suffix (str): the file suffix (e.g. "profile").
+        """
         self.current_user = current_user
-        self.profiles_dir = Path.home() / ".local/share/konsole"
+        self.profiles_dir = profiles_dir
+        self.suffix = suffix
+        # File contents known to be on disk, as last written or
+        # verified by this object.
+        self.rendered: Dict[Path, str] = {}
+
+    @abstractmethod
+    def make_config_file(self, profile: Profile) -> str:
+        """
+        Create and return the file contents for a profile spec.
+
+        Args:
+            profile (Profile): the Profile spec object.
+
+        Returns:
+            str: the file contents.
+        """
+        pass
+
+    def make_specs(self, profiles: List[Profile]) -> List[FileSpec]:
+        """
+        Render files for a batch of profiles.
+
+        Args:
+            profiles (List[Profile]): the profiles.
+
+        Returns:
+            List[FileSpec]: the file paths and contents.
+        """
+        return [
+            FileSpec(
+                self.make_config_file(p),
+                p.get_file_path(self.profiles_dir, self.suffix),
+            )
+            for p in profiles
+        ]
+
+    def get_render_inputs(self) -> str:
+        """
+        Returns a fingerprint of what the file contents depend on besides
+        the profiles themselves.
+
+        Returns:
+            str: the fingerprint.
+        """
+        return make_fingerprint(self.get_target_name(), self.get_input_identity())
+
+    def get_manifest_diff(
+        self, profiles: List[Profile], inputs: str
+    ) -> Optional[ProfileDiff]:
+        """
+        Compare a profile set with the one recorded in the manifest.
+
+        Args:
+            profiles (List[Profile]): the new profiles.
+            inputs (str): the current rendering inputs, see
+                          `get_render_inputs`.
+
+        Returns:
+            Optional[ProfileDiff]: the difference, or None if the manifest
+                                   is unreadable or was written with other
+                                   rendering inputs.
+        """
+        try:
+            data = read_manifest_data(self.profiles_dir)
+            if data["inputs"] != inputs:
+                return None
+            held = [Profile.from_dict(v) for v in data["profiles"].values()]
+        except (OSError, ValueError, KeyError, AttributeError, TypeError):
+            return None
+        return diff_profiles(held, profiles)
+
+    def make_targets(
+        self,
+        profiles: List[Profile],
+        fingerprint: Optional[str] = None,
+        verify: bool = False,
+        cancel: Optional[Event] = None,
+    ) -> MergePlan:
+        inputs = self.get_render_inputs()
+        diff = None if verify else self.get_manifest_diff(profiles, inputs)
+        if diff is not None:
+            logging.info(
+                f"{self.get_target_name()}: {len(diff.added)} added, "
+                f"{len(diff.removed)} removed, {len(diff.renamed)} renamed, "
+                f"{len(diff.changed)} changed, {diff.unchanged} unchanged."
+            )
+            updated = diff.get_updated()
+            changed = {p.get_root_name() for p in updated}
+            plan = self.write_delta(
+                updated,
+                diff.get_removed(),
+                [
+                    p.get_file_path(self.profiles_dir, self.suffix)
+                    for p in profiles
+                    if p.get_root_name() not in changed
+                ],
+                cancel,
+            )
+        else:
+            with metrics.phase("rendering"):
+                specs = self.make_specs(profiles)
+            try:
+                plan = merge_file_tree(
+                    root=self.profiles_dir,
+                    glob=Profile.get_file_glob(self.suffix),
+                    specs=specs,
+                    cancel=cancel,
+                )
+            except BaseException:
+                self.invalidate()
+                raise
+            self.rendered = {s.path: s.content for s in specs}
+        check_cancelled(cancel)
+        # Written last, so that an interrupted write leaves a stale
+        # manifest that doesn't match on the next run.
+        make_manifest(self.profiles_dir, profiles, fingerprint, inputs)
+        return plan
+
+    def invalidate(self) -> None:
+        """
+        Forget what is known about the files after an interrupted write:
+        the rendered contents, and the manifest's fingerprints, so that
+        the next write checks every file on disk.
+        """
+        self.rendered = {}
+        try:
+            update_manifest(self.profiles_dir, [], [], None, None)
+        except (OSError, ValueError, KeyError, AttributeError, TypeError):
+            pass
+
+    def get_fingerprint(self) -> Optional[str]:
+        return read_fingerprint(self.profiles_dir)
+
+    def get_lock_path(self) -> Optional[Path]:
+        return self.profiles_dir / LOCK_NAME
+
+    def get_profiles(self) -> Optional[List[Profile]]:
+        try:
+            return read_manifest(self.profiles_dir)
+        except (OSError, ValueError, KeyError, AttributeError, TypeError):
+            return None
+
+    def get_cursor(self) -> Optional[Tuple[str, str]]:
+        return read_cursor(self.profiles_dir)
+
+    def save_cursor(self, cursor: str, fingerprint: str) -> None:
+        write_cursor(self.profiles_dir, cursor, fingerprint)
+
+    def apply_delta(
+        self,
+        updated: List[Profile],
+        removed: List[Profile],
+        fingerprint: Optional[str] = None,
+        cancel: Optional[Event] = None,
+    ) -> MergePlan:
+        held = read_manifest_data(self.profiles_dir)["inputs"]
+        plan = self.write_delta(updated, removed, cancel=cancel)
+        check_cancelled(cancel)
+        # The untouched files can only be trusted if they were rendered
+        # with the current inputs.
+        inputs = self.get_render_inputs()
+        update_manifest(
+            self.profiles_dir,
+            updated,
+            removed,
+            fingerprint,
+            inputs if held == inputs else None,
+        )
+        return plan
+
+    def write_delta(
+        self,
+        updated: List[Profile],
+        removed: List[Profile],
+        unchanged: Optional[List[Path]] = None,
+        cancel: Optional[Event] = None,
+    ) -> MergePlan:
+        """
+        Write the files of updated profiles and delete those of removed
+        ones, without touching the manifest unless interrupted, see
+        `invalidate`.
+
+        Args:
+            updated (List[Profile]): the profiles to add or update.
+            removed (List[Profile]): the profiles to remove.
+            unchanged (Optional[List[Path]]): files already known to be
+                                              unchanged, reported in the
+                                              plan as such.
+            cancel (Optional[Event]): stops writing, see `make_targets`.
+
+        Returns:
+            MergePlan: the changes made.
+        """
+        add, update, specs = [], [], []
+        unchanged = list(unchanged or [])
+        with metrics.phase("rendering"):
+            rendered = self.make_specs(updated)
+        for spec in rendered:
+            known = self.rendered.get(spec.path)
+            if known == spec.content:
+                unchanged.append(spec.path)
+                continue
+            if known is None and not spec.path.is_file():
+                add.append(spec.path)
+            else:
+                update.append(spec.path)
+            specs.append(spec)
+        delete = [
+            path
+            for p in removed
+            if (path := p.get_file_path(self.profiles_dir, self.suffix))
+            in self.rendered
+            or path.is_file()
+        ]
+        plan = MergePlan(add=add, update=update, delete=delete, unchanged=unchanged)
+        try:
+            apply_merge_plan(self.profiles_dir, plan, specs, cancel)
+        except BaseException:
+            self.invalidate()
+            raise
+        self.rendered.update({s.path: s.content for s in specs})
+        for path in delete:
+            self.rendered.pop(path, None)
+        return plan
+
+
+class KonsoleTarget(FileTarget):
+    """
+    Konsole profiles. Yakuake (and other KDE applications embedding
+    Konsole) read profiles from the same directory.
+    """
+
+    def __init__(self, current_user: str) -> None:
+        super().__init__(current_user, Path.home() / ".local/share/konsole", "profile")
         self.rc_file = Path.home() / ".config/konsolerc"
 
     def get_target_name(self) -> str:
@@ -88,17 +477,10 @@ class KonsoleTarget(ProfileTarget):
         Returns:
             str: the parent Konsole profile.
         """
-        if not self.rc_file.is_file():
+        default_profile = get_default_profile(self.rc_file)
+        if default_profile is None:
             return "FALLBACK/"
-        with open(self.rc_file, "r") as f:
-            lines = [
-                line.split("=")[1]
-                for line in f.readlines()
-                if line.startswith("DefaultProfile=")
-            ]
-            if len(lines) < 1:
-                return "FALLBACK/"
-            return Path.home() / f".local/share/konsole/{lines[0]}"
+        return str(self.profiles_dir / default_profile)
 
     #     def make_profile(self, profile: Profile) -> FileSpec:
     #         return f"""
@@ -108,47 +490,119 @@ class KonsoleTarget(ProfileTarget):
     # Parent={self.get_parent_profile()}
     #         """.strip()
 
-    def make_config_file(self, profile: Profile) -> str:
+    def make_config_file(self, profile: Profile, parent: Optional[str] = None) -> str:
         """
         Create and return the contents of a Konsole profile from
-        a profile spec.
+        a profile spec, preferring its fast-enter command if it has one.
 
         Args:
             profile (Profile): the Profile spec object.
+            parent (Optional[str]): the parent profile, as returned by
+                                    `get_parent_profile`; looked up if
+                                    None.
 
         Returns:
             str: the .profile file contents.
         """
+        if parent is None:
+            parent = self.get_parent_profile()
+        command = profile.fast_exec_command or profile.exec_command
         return f"""
 [General]
-Command={profile.exec_command}{f"\nIcon={profile.icon}" if profile.icon is not None else ""}
+Command={command}{f"\nIcon={profile.icon}" if profile.icon is not None else ""}
 Name={profile.get_friendly_name()}
-Parent={self.get_parent_profile()}
+Parent={parent}
         """.strip()
 
-    def make_targets(self, profiles: List[Profile]) -> None:
-        make_manifest(self.profiles_dir, profiles)
-        merge_file_tree(
-            root=self.profiles_dir,
-            glob=Profile.get_file_glob("profile"),
-            specs=[
-                FileSpec(
-                    self.make_config_file(p),
-                    p.get_file_path(self.profiles_dir, "profile"),
-                )
-                for p in profiles
-            ],
-        )
+    def make_specs(self, profiles: List[Profile]) -> List[FileSpec]:
+        parent = self.get_parent_profile()
+        return [
+            FileSpec(
+                self.make_config_file(p, parent),
+                p.get_file_path(self.profiles_dir, self.suffix),
+            )
+            for p in profiles
+        ]
+
+    def get_input_identity(self) -> Any:
+        return get_file_identity(self.rc_file)
+
+    def get_watch_paths(self) -> List[Path]:
+        return [self.rc_file]
 
     def check_dependencies(self) -> bool:
         return all([command_exists("konsole"), directory_exists(self.profiles_dir)])
 
 
-def get_targets(query: List[str], current_user: str) -> Dict[str, ProfileTarget]:
+class DesktopTarget(FileTarget):
+    """
+    Application menu launchers (.desktop entries), opening each profile's
+    command in the default terminal.
+    """
+
+    def __init__(self, current_user: str) -> None:
+        super().__init__(
+            current_user, Path.home() / ".local/share/applications", "desktop"
+        )
+
+    def get_target_name(self) -> str:
+        return "desktop"
+
+    def make_config_file(self, profile: Profile) -> str:
+        """
+        Create and return the contents of a desktop entry from
+        a profile spec.
+
+        Args:
+            profile (Profile): the Profile spec object.
+
+        Returns:
+            str: the .desktop file contents.
+        """
+        # Literal percent signs must be doubled in Exec keys.
+        exec_command = profile.exec_command.replace("%", "%%")
+        return f"""
+[Desktop Entry]
+Type=Application
+Name={profile.get_friendly_name()}
+Exec={exec_command}{f"\nIcon={profile.icon}" if profile.icon is not None else ""}
+Terminal=true
+Categories=System;
+        """.strip()
+
+    def get_post_commit_hooks(self) -> List[List[str]]:
+        hooks = []
+        if command_exists("update-desktop-database"):
+            hooks.append(["update-desktop-database", str(self.profiles_dir)])
+        for command in ["kbuildsycoca6", "kbuildsycoca5"]:
+            if command_exists(command):
+                hooks.append([command])
+                break
+        return hooks
+
+    def check_dependencies(self) -> bool:
+        return directory_exists(self.profiles_dir)
+
+
+# Target names accepted by `get_targets`, mapped to the target that
+# serves them.
+TARGET_ALIASES = {"konsole": "konsole", "yakuake": "konsole", "desktop": "desktop"}
+
+
+def get_targets(query: List[str], current_user: str) -> List[ProfileTarget]:
     """
-    VESTIGIAL; Returns target objects that match a query.
+    Returns target objects that match a query.
+
+    Args:
+        query (List[str]): target names (see `TARGET_ALIASES`), or
+                           ["all"].
+        current_user (str): username of the current user.
+
+    Returns:
+        List[ProfileTarget]: the targets, each at most once.
     """
-    all_sources = [KonsoleTarget(current_user)]
+    all_targets = [KonsoleTarget(current_user), DesktopTarget(current_user)]
     if "all" in query:
-        return all_sources
-    return [s for s in all_sources if s.get_target_name() in query]
+        return all_targets
+    names = {TARGET_ALIASES[q] for q in query if q in TARGET_ALIASES}
+    return [t for t in all_targets if t.get_target_name() in names]
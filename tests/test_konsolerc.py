@@ -0,0 +1,70 @@
+"""
+konsole-distrobox-integration
+
+test_konsolerc.py: tests for reading Konsole's default profile from
+                   konsolerc, as KConfig writes it.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from konsoledistroboxintegration.konsolerc import get_default_profile, read_ini
+
+
+def write_rc(tmp_path: Path, content: str) -> Path:
+    rc_file = tmp_path / "konsolerc"
+    rc_file.write_text(content)
+    return rc_file
+
+
+def test_plain_key(tmp_path: Path) -> None:
+    rc_file = write_rc(tmp_path, "[Desktop Entry]\nDefaultProfile=Main.profile\n")
+    assert get_default_profile(rc_file) == "Main.profile"
+
+
+@pytest.mark.parametrize("flags", ["[$i]", "[$e]", "[$ie]", "[$i][$e]"])
+def test_key_flags_are_stripped(tmp_path: Path, flags: str) -> None:
+    rc_file = write_rc(
+        tmp_path, f"[Desktop Entry]\nDefaultProfile{flags}=Main.profile\n"
+    )
+    assert get_default_profile(rc_file) == "Main.profile"
+
+
+def test_expanded_key(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("KONSOLE_TEST_PROFILE", "Work")
+    rc_file = write_rc(
+        tmp_path,
+        "[Desktop Entry]\nDefaultProfile[$e]=${KONSOLE_TEST_PROFILE}.profile\n",
+    )
+    assert get_default_profile(rc_file) == "Work.profile"
+
+
+def test_immutable_group(tmp_path: Path) -> None:
+    rc_file = write_rc(tmp_path, "[Desktop Entry][$i]\nDefaultProfile=Main.profile\n")
+    assert get_default_profile(rc_file) == "Main.profile"
+
+
+def test_localised_key_does_not_override(tmp_path: Path) -> None:
+    rc_file = write_rc(
+        tmp_path,
+        "[Desktop Entry]\nDefaultProfile=Main.profile\nDefaultProfile[de]=De.profile\n",
+    )
+    assert get_default_profile(rc_file) == "Main.profile"
+
+
+def test_escaped_value(tmp_path: Path) -> None:
+    rc_file = write_rc(tmp_path, "[General]\nName=\\sMy\\tProfile\\\\\n")
+    assert read_ini(rc_file)["General"]["Name"] == " My\tProfile\\"
+
+
+def test_missing_key(tmp_path: Path) -> None:
+    rc_file = write_rc(tmp_path, "[Desktop Entry]\nFullScreen=false\n")
+    assert get_default_profile(rc_file) is None
+    assert get_default_profile(tmp_path / "missing") is None
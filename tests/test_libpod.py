@@ -0,0 +1,209 @@
+"""
+konsole-distrobox-integration
+
+test_libpod.py: tests for the libpod API client, against a stub server on
+                a local Unix socket.
+
+Author: jahinzee <jahinzee@outlook.com>
+
+This Source Code Form is subject to the terms of the Mozilla Public
+License, v. 2.0. If a copy of the MPL was not distributed with this
+file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""
+
+import json
+import asyncio
+import socketserver
+from typing import Iterator, List
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler
+from threading import Event, Thread, Timer
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from konsoledistroboxintegration.commands import Cancelled
+from konsoledistroboxintegration.events import EventKind
+from konsoledistroboxintegration.libpod import (
+    API_PREFIX,
+    LibpodClient,
+    LibpodError,
+    stream_events,
+)
+
+CONTAINERS = [
+    {"Id": "abc123", "Names": ["box1"], "Image": "fedora", "State": "running"},
+    {"Id": "def456", "Names": ["box2"], "Image": "ubuntu", "State": "exited"},
+]
+EVENTS = [
+    {
+        "Type": "container",
+        "Action": "create",
+        "Actor": {
+            "ID": "abc123",
+            "Attributes": {"name": "box1", "image": "fedora", "manager": "distrobox"},
+        },
+        "timeNano": 1_700_000_000_000_000_000,
+    },
+    {"Type": "image", "Action": "pull", "Actor": {"ID": "fedora"}},
+    {
+        "Type": "container",
+        "Action": "remove",
+        "Actor": {"ID": "def456", "Attributes": {"name": "box2"}},
+    },
+]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves a libpod-like API: the container listing, and the event stream
+    (chunked, with chunks splitting event lines, or read to EOF).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        self.server.connections += 1
+        super().setup()
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_body(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query)))
+        if url.path == f"{API_PREFIX}/containers/json":
+            sleep(self.server.delay)
+            self.send_body(200, json.dumps(CONTAINERS).encode("utf-8"))
+            if self.server.drop_keepalive:
+                # Close without telling the client, as an idle podman would.
+                self.close_connection = True
+        elif url.path == f"{API_PREFIX}/events":
+            data = b"".join(json.dumps(e).encode("utf-8") + b"\n" for e in EVENTS)
+            self.send_response(200)
+            if self.server.chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i in range(0, len(data), 37):
+                    chunk = data[i : i + 37]
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(data)
+                self.close_connection = True
+        else:
+            self.send_body(404, b'{"message": "no such endpoint"}')
+
+
+class StubServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(str(path), StubHandler)
+        self.connections = 0
+        self.requests: List[tuple] = []
+        self.chunked = True
+        self.drop_keepalive = False
+        self.delay = 0.0
+
+
+@pytest.fixture
+def server(tmp_path: Path) -> Iterator[StubServer]:
+    stub = StubServer(tmp_path / "podman.sock")
+    thread = Thread(target=stub.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+def get_socket(server: StubServer) -> Path:
+    return Path(server.server_address)
+
+
+def test_list_containers_filters_and_reuses_connection(server: StubServer) -> None:
+    client = LibpodClient(get_socket(server))
+    try:
+        assert client.list_containers("manager=distrobox") == CONTAINERS
+        assert client.list_containers(None, all=False) == CONTAINERS
+    finally:
+        client.close()
+    assert server.connections == 1
+    (_, first), (_, second) = server.requests
+    assert first["all"] == ["true"]
+    assert json.loads(first["filters"][0]) == {"label": ["manager=distrobox"]}
+    assert second["all"] == ["false"]
+    assert "filters" not in second
+
+
+def test_list_containers_retries_closed_connection(server: StubServer) -> None:
+    server.drop_keepalive = True
+    client = LibpodClient(get_socket(server))
+    try:
+        assert client.list_containers(None) == CONTAINERS
+        assert client.list_containers(None) == CONTAINERS
+    finally:
+        client.close()
+    assert server.connections == 2
+
+
+def test_get_raises_on_error_status(server: StubServer) -> None:
+    client = LibpodClient(get_socket(server))
+    try:
+        with pytest.raises(LibpodError, match="HTTP 404"):
+            client.get("/nonexistent", {})
+    finally:
+        client.close()
+
+
+def test_get_raises_without_server(tmp_path: Path) -> None:
+    client = LibpodClient(tmp_path / "missing.sock")
+    with pytest.raises(LibpodError):
+        client.list_containers(None)
+
+
+def test_list_containers_cancelled(server: StubServer) -> None:
+    server.delay = 5.0
+    client = LibpodClient(get_socket(server))
+    cancel = Event()
+    Timer(0.2, cancel.set).start()
+    start = monotonic()
+    try:
+        with pytest.raises(Cancelled):
+            client.list_containers(None, cancel=cancel)
+        assert monotonic() - start < 2.0
+        with pytest.raises(Cancelled):
+            client.list_containers(None, cancel=cancel)
+    finally:
+        client.close()
+
+
+async def collect_events(path: Path, since=None) -> list:
+    return [e async for e in stream_events(path, since)]
+
+
+@pytest.mark.parametrize("chunked", [True, False])
+def test_stream_events(server: StubServer, chunked: bool) -> None:
+    server.chunked = chunked
+    events = asyncio.run(collect_events(get_socket(server), since=1700000000.4))
+    assert [(e.kind, e.container_id, e.name) for e in events] == [
+        (EventKind.CREATE, "abc123", "box1"),
+        (EventKind.REMOVE, "def456", "box2"),
+    ]
+    assert events[0].image == "fedora"
+    assert events[0].labels == {"manager": "distrobox"}
+    assert events[0].timestamp == pytest.approx(1_700_000_000)
+    ((_, query),) = server.requests
+    assert query["stream"] == ["true"]
+    assert query["since"] == ["1700000000"]
+    assert json.loads(query["filters"][0])["type"] == ["container"]